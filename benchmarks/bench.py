@@ -0,0 +1,334 @@
+"""
+Benchmarks for the fetch/parse/fix/build pipeline.
+
+Run from the repository root:
+
+    python benchmarks/bench.py [--quick] [-o results.json]
+
+Results are printed (or written) as JSON so runs can be compared. The exit
+status is non-zero if importing the CLI exceeds its time budget or loads any
+of the heavy dependencies that should only be imported on demand.
+"""
+
+import argparse
+import copy
+import functools
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from rssbuilder import Builder, Parser, Query
+from rssbuilder.consts import VERSION
+from rssbuilder.fixers import ALL as ALL_FIXERS
+from rssbuilder.models import Config, FeedInfo, Queries
+
+SAMPLES_DIR = Path(__file__).parent.parent / "tests" / "samples"
+
+SAMPLES = {
+    "tvcs.html": dict(
+        entries=".rss_item",
+        link=Query(selector=".title a", target="href"),
+        title=".title",
+        image=Query(selector="amp-img", target="src"),
+        content=".rss_content p",
+        date=".rss_content small",
+    ),
+    "vivecastellon.html": dict(
+        entries=".top-noticias-noticia",
+        link=Query(selector="a.top-noticias-noticia-mas-info", target="href"),
+        title=".top-noticias-noticia-title",
+        image=Query(selector=".top-noticias-noticia img", target="src"),
+        content=None,
+        date=None,
+    ),
+}
+
+# Importing the CLI must stay below this (cumulative, as reported by
+# `python -X importtime`) and must not pull any of these modules
+IMPORT_BUDGET_MS = 50
+IMPORT_FORBIDDEN = ["bs4", "lxml", "selectolax", "pydantic", "yaml", "platformdirs"]
+
+SYNTHETIC_QUERIES = {
+    "entries": ".rss_item",
+    "link": {"selector": ".title a", "target": "href"},
+    "title": ".title",
+    "image": {"selector": "amp-img", "target": "src"},
+    "content": ".rss_content p",
+    "date": ".rss_content small",
+}
+
+
+def synthetic_page(entries: int, filler: int = 0) -> bytes:
+    """
+    Listing page shaped like tvcs.html with `entries` items and `filler`
+    bytes of scripts and inline SVG no query cares about
+    """
+    item = (
+        '<li class="rss_item"><div class="rss_image">'
+        '<a href="/contenido/{i}/entry-{i}"><amp-img src="/img/{i}.webp"></amp-img>'
+        '</a></div><span class="title"><a href="/contenido/{i}/entry-{i}">'
+        "Entry number {i} &amp; friends</a></span>"
+        '<div class="rss_content"><small>on 28 d\'agost de 2024</small>'
+        "<p>Summary of entry {i}, long enough to look like a real one.</p>"
+        "<p>Second paragraph of entry {i}.</p></div></li>"
+    )
+    chunk = "<script>var data = " + json.dumps(list(range(200))) + ";</script>"
+    chunk += '<svg><path d="' + "M0 0 L10 10 " * 50 + '"/></svg>'
+
+    parts = [
+        "<html><head><title>Synthetic</title>",
+        '<link rel="canonical" href="https://example.com/">',
+        "</head><body>",
+    ]
+    parts.extend(chunk for _ in range(filler // len(chunk)))
+    parts.append("<ul>")
+    parts.extend(item.format(i=i) for i in range(entries))
+    parts.append("</ul></body></html>")
+
+    return "".join(parts).encode("utf-8")
+
+
+def measure(fn: Callable[[], object], repeat: int, work: int = 1) -> dict:
+    """
+    Time `repeat` calls of `fn` and measure peak traced memory of an extra
+    call. `work` is the number of items (entries, feeds…) processed per call
+    """
+    fn()  # warm up caches and imports
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if len(times) > 1:
+        p50, p90, p99 = (
+            statistics.quantiles(times, n=100, method="inclusive")[x]
+            for x in (49, 89, 98)
+        )
+    else:
+        p50 = p90 = p99 = times[0]
+
+    return {
+        "repeat": repeat,
+        "mean_s": statistics.fmean(times),
+        "min_s": min(times),
+        "p50_s": p50,
+        "p90_s": p90,
+        "p99_s": p99,
+        "throughput_per_s": work / statistics.fmean(times),
+        "peak_memory_bytes": peak,
+    }
+
+
+def bench_stages(name: str, buff: bytes, parser: Parser, repeat: int) -> dict:
+    feed_info = FeedInfo(url="https://example.com/", name=name)
+
+    parsed = parser.parse(buff)
+    fixed = copy.deepcopy(parsed)
+    for FixerCls in ALL_FIXERS:
+        FixerCls(feed_info).fix(fixed)
+
+    def fix():
+        data = copy.deepcopy(parsed)
+        for FixerCls in ALL_FIXERS:
+            FixerCls(feed_info).fix(data)
+
+    n = len(parsed.entries)
+    return {
+        "input_bytes": len(buff),
+        "entries": n,
+        "parse": measure(lambda: parser.parse(buff), repeat, n),
+        # Includes the copy of parsed data, fixers modify it in place
+        "fix": measure(fix, repeat, n),
+        "build": measure(lambda: Builder().build(copy.copy(fixed)), repeat, n),
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    pages: dict[str, bytes] = {}
+
+    def log_message(self, *args, **kwargs):
+        pass
+
+    def do_GET(self):
+        body = self.pages.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def bench_end_to_end(feeds: int, entries: int, repeat: int, jobs: int) -> dict:
+    from rssbuilder import cli
+
+    page = synthetic_page(entries)
+    handler = type("Handler", (StubHandler,), {"pages": {}})
+    for i in range(feeds):
+        handler.pages[f"/feed/{i}"] = page
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+
+            def run():
+                # Fresh cache and output each time, every feed is fetched
+                # and built
+                base = Path(tempfile.mkdtemp(dir=tmpdir))
+                config = Config(
+                    output_dir=base / "output",
+                    cache_dir=base / "cache",
+                    feeds=[
+                        {
+                            "name": f"feed {i}",
+                            "url": f"http://127.0.0.1:{httpd.server_port}/feed/{i}",
+                            "queries": SYNTHETIC_QUERIES,
+                        }
+                        for i in range(feeds)
+                    ],
+                )
+                cli.build(config, argparse.Namespace(jobs=jobs, force=True))
+
+            return {
+                "feeds": feeds,
+                "entries_per_feed": entries,
+                "jobs": jobs,
+                "run": measure(run, repeat, feeds),
+            }
+
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def bench_import(repeat: int, budget_ms: float) -> dict:
+    code = (
+        "import sys, rssbuilder.cli; "
+        f"print(','.join(m for m in {IMPORT_FORBIDDEN!r} if m in sys.modules))"
+    )
+
+    import_times = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        for line in proc.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            _, cumulative, module = line.split("|")
+            if module.strip() == "rssbuilder.cli":
+                import_times.append(int(cumulative) / 1000)
+
+        loaded = [x for x in proc.stdout.strip().split(",") if x]
+
+    help_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "rssbuilder", "--help"],
+            capture_output=True,
+            check=True,
+        )
+        help_times.append(time.perf_counter() - start)
+
+    import_ms = min(import_times)
+    return {
+        "cli_import_ms": import_ms,
+        "help_wall_s": min(help_times),
+        "budget_ms": budget_ms,
+        "forbidden_loaded": loaded,
+        "ok": import_ms <= budget_ms and not loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output", type=Path, help="Write results here")
+    parser.add_argument("-r", "--repeat", type=int, default=10)
+    parser.add_argument(
+        "--quick", action="store_true", help="Smaller synthetic inputs and repeats"
+    )
+    parser.add_argument("--backend", default="html.parser")
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument(
+        "--import-budget",
+        type=float,
+        default=IMPORT_BUDGET_MS,
+        help="Maximum time (ms) to import the CLI",
+    )
+    args = parser.parse_args()
+
+    repeat = 3 if args.quick else args.repeat
+    scale = 10 if args.quick else 1
+
+    results: dict = {
+        "version": VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": args.backend,
+        "import": bench_import(repeat, args.import_budget),
+        "stages": {},
+    }
+
+    parser_for = functools.partial(Parser, backend=args.backend)
+
+    for name, params in SAMPLES.items():
+        buff = (SAMPLES_DIR / name).read_bytes()
+        results["stages"][name] = bench_stages(name, buff, parser_for(**params), repeat)
+
+    synthetic = {
+        "synthetic-many-entries": synthetic_page(10_000 // scale),
+        "synthetic-large-page": synthetic_page(100, filler=4_000_000 // scale),
+    }
+    synthetic_parser = Parser.from_queries(
+        Queries.model_validate(SYNTHETIC_QUERIES), backend=args.backend
+    )
+    for name, buff in synthetic.items():
+        results["stages"][name] = bench_stages(
+            name, buff, synthetic_parser, max(1, repeat // 3)
+        )
+
+    results["end_to_end"] = bench_end_to_end(
+        feeds=50 // scale or 1,
+        entries=100,
+        repeat=max(1, repeat // 3),
+        jobs=args.jobs,
+    )
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+    if not results["import"]["ok"]:
+        print(f"import budget exceeded: {results['import']}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
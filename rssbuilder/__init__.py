@@ -16,11 +16,40 @@
 # USA.
 
 
-from .builder import Builder
+import importlib
+from typing import TYPE_CHECKING
+
 from .consts import NAME
-from .fetcher import Fetcher
-from .models import Config
-from .parser import Parser
-from .query import Query
+
+if TYPE_CHECKING:
+    from .builder import Builder
+    from .fetcher import Fetcher
+    from .models import Config
+    from .parser import Parser
+    from .query import Query
 
 __all__ = ["Fetcher", "Parser", "Query", "Builder", "Config", "NAME"]
+
+# Public names are resolved on first access (PEP 562) so importing the
+# package, or the CLI, doesn't load pydantic, yaml or the HTML parsers
+_LAZY = {
+    "Builder": "builder",
+    "Config": "models",
+    "Fetcher": "fetcher",
+    "Parser": "parser",
+    "Query": "query",
+}
+
+
+def __getattr__(name: str):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f".{_LAZY[name]}", __name__), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *_LAZY})
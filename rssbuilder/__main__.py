@@ -16,7 +16,9 @@
 # USA.
 
 
+import sys
+
 from .cli import main
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
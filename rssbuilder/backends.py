@@ -0,0 +1,192 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import abc
+import functools
+import importlib.util
+import logging
+from collections.abc import Iterator
+from typing import Any, Literal
+
+from .strainer import ALWAYS_KEPT, Region
+
+LOGGER = logging.getLogger(__name__)
+
+BackendName = Literal["html.parser", "lxml", "selectolax"]
+
+DEFAULT_BACKEND: BackendName = "html.parser"
+
+# Attributes that BeautifulSoup splits into lists for HTML documents, other
+# backends have to mimic it so queries using `attributes` behave the same
+MULTI_VALUED_ATTRIBUTES = {
+    "accept-charset",
+    "accesskey",
+    "class",
+    "dropzone",
+    "headers",
+    "rel",
+    "rev",
+}
+
+
+class Backend(abc.ABC):
+    """
+    HTML engine used by `Parser` and `query` functions.
+
+    Nodes are opaque objects for everything outside the backend.
+    """
+
+    name: BackendName
+
+    @abc.abstractmethod
+    def parse(self, buff: bytes, regions: list[Region] | None = None) -> Any:
+        """
+        Parse `buff`. If `regions` is given backends are allowed to skip any
+        element not matching them (and not in `strainer.ALWAYS_KEPT`) along
+        with its descendants.
+        """
+        pass
+
+    def compile(self, selector: str) -> Any:
+        """
+        Prepare `selector` to be used with `select`. Backends without
+        precompiled selectors return it unchanged.
+        """
+        return selector
+
+    @abc.abstractmethod
+    def select(self, node: Any, selector: Any) -> list[Any]:
+        pass
+
+    def iselect(self, node: Any, selector: Any) -> Iterator[Any]:
+        """
+        Like `select` but matches are produced as the tree is walked, when
+        the backend supports it
+        """
+        return iter(self.select(node, selector))
+
+    def release(self, node: Any) -> None:
+        """
+        Free `node` and its descendants, it must not be used afterwards
+        """
+        pass
+
+    @abc.abstractmethod
+    def attrs(self, node: Any) -> dict[str, str | list[str]]:
+        pass
+
+    @abc.abstractmethod
+    def text(self, node: Any) -> str:
+        pass
+
+
+class SoupBackend(Backend):
+    def __init__(self, name: Literal["html.parser", "lxml"]):
+        self.name = name
+
+    def parse(self, buff: bytes, regions: list[Region] | None = None) -> Any:
+        import bs4
+
+        if regions is None:
+            return bs4.BeautifulSoup(buff, features=self.name)
+
+        class RegionStrainer(bs4.SoupStrainer):
+            # BeautifulSoup only asks for elements outside already kept ones
+            def allow_tag_creation(self, nsprefix, name, attrs):
+                attrs = attrs or {}
+                return name in ALWAYS_KEPT or any(
+                    r.matches(name, attrs) for r in regions
+                )
+
+        return bs4.BeautifulSoup(buff, features=self.name, parse_only=RegionStrainer())
+
+    def compile(self, selector: str) -> Any:
+        import soupsieve
+
+        return soupsieve.compile(selector)
+
+    def select(self, node: Any, selector: Any) -> list[Any]:
+        if isinstance(selector, str):
+            return node.select(selector)
+
+        return selector.select(node)
+
+    def iselect(self, node: Any, selector: Any) -> Iterator[Any]:
+        if isinstance(selector, str):
+            return node.css.iselect(selector)
+
+        return selector.iselect(node)
+
+    def release(self, node: Any) -> None:
+        node.decompose()
+
+    def attrs(self, node: Any) -> dict[str, str | list[str]]:
+        return node.attrs
+
+    def text(self, node: Any) -> str:
+        return node.text
+
+
+class SelectolaxBackend(Backend):
+    name = "selectolax"
+
+    def parse(self, buff: bytes, regions: list[Region] | None = None) -> Any:
+        # lexbor has no partial parsing, regions are ignored
+        from selectolax.lexbor import LexborHTMLParser
+
+        return LexborHTMLParser(buff)
+
+    def select(self, node: Any, selector: Any) -> list[Any]:
+        return node.css(selector)
+
+    def release(self, node: Any) -> None:
+        node.decompose()
+
+    def attrs(self, node: Any) -> dict[str, str | list[str]]:
+        return {
+            k: (v or "").split() if k in MULTI_VALUED_ATTRIBUTES else (v or "")
+            for k, v in node.attributes.items()
+        }
+
+    def text(self, node: Any) -> str:
+        return node.text(deep=True)
+
+
+# Backend name, module required to use it and backend to use if it's missing
+_REGISTRY: dict[BackendName, tuple[str | None, BackendName | None]] = {
+    "selectolax": ("selectolax", "lxml"),
+    "lxml": ("lxml", "html.parser"),
+    "html.parser": (None, None),
+}
+
+
+@functools.cache
+def get_backend(name: BackendName = DEFAULT_BACKEND) -> Backend:
+    if name not in _REGISTRY:
+        raise ValueError(name)
+
+    module, fallback = _REGISTRY[name]
+    if module and importlib.util.find_spec(module) is None:
+        assert fallback is not None
+        LOGGER.warning(f"backend '{name}' not available, using '{fallback}'")
+        return get_backend(fallback)
+
+    if name == "selectolax":
+        return SelectolaxBackend()
+
+    return SoupBackend(name)
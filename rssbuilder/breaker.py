@@ -0,0 +1,152 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from urllib import parse
+
+LOGGER = logging.getLogger(__name__)
+
+# First retry delay after a failure, doubled on each consecutive failure
+RETRY_DELAY = 60.0
+MAX_RETRY_DELAY = 60.0 * 60 * 6
+
+
+def retry_delay(failures: int) -> float:
+    """
+    Exponential backoff after `failures` consecutive failures, never waiting
+    less than `RETRY_DELAY` nor more than `MAX_RETRY_DELAY`
+    """
+    return min(RETRY_DELAY * 2 ** min(failures - 1, 16), MAX_RETRY_DELAY)
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker persisted across runs.
+
+    Consecutive fetch failures are counted per host. Once `threshold` is
+    reached the circuit opens and requests to that host are skipped until
+    a backoff deadline (see `retry_delay`). After it, one attempt is allowed
+    (half-open): success closes the circuit, failure opens it again for
+    longer. A `threshold` of 0 disables the breaker.
+
+    Breakers are thread-safe, background fetches can report to them.
+    """
+
+    def __init__(self, filepath: Path, threshold: int = 3):
+        self.filepath = filepath
+        self.threshold = threshold
+        self.hosts: dict[str, dict[str, float]] = {}
+        self._probing: set[str] = set()
+        self._updated: set[str] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host(url: str) -> str:
+        return parse.urlsplit(url).netloc.lower()
+
+    def _read(self) -> dict[str, dict[str, float]]:
+        try:
+            return json.loads(self.filepath.read_text())
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            LOGGER.warning(f"Ignoring invalid circuit breaker state {self.filepath}")
+            return {}
+
+    def load(self) -> None:
+        self.hosts = self._read()
+
+    def save(self) -> None:
+        from .output import write_atomic
+
+        with self._lock:
+            # Other workers could have saved the state of their hosts since it
+            # was loaded, only the hosts updated here are replaced
+            hosts = self._read()
+            for host in self._updated:
+                if host in self.hosts:
+                    hosts[host] = self.hosts[host]
+                else:
+                    hosts.pop(host, None)
+
+            self._updated.clear()
+            self.hosts = hosts
+            contents = json.dumps(self.hosts, indent=2).encode("utf-8")
+
+        write_atomic(self.filepath, contents)
+
+    def allow(self, url: str, now: float | None = None) -> bool:
+        if not self.threshold:
+            return True
+
+        now = time.time() if now is None else now
+        host = self.host(url)
+        with self._lock:
+            state = self.hosts.get(host)
+            if not state or state["failures"] < self.threshold:
+                return True
+
+            # Half-open, a single request probes the host
+            if host in self._probing or now < state["open_until"]:
+                return False
+
+            self._probing.add(host)
+            return True
+
+    def retry_at(self, url: str) -> float:
+        return self.hosts.get(self.host(url), {}).get("open_until", 0.0)
+
+    def success(self, url: str) -> None:
+        host = self.host(url)
+        with self._lock:
+            self._probing.discard(host)
+            self.hosts.pop(host, None)
+            self._updated.add(host)
+
+    def failure(self, url: str, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        host = self.host(url)
+        with self._lock:
+            self._probing.discard(host)
+            failures = int(self.hosts.get(host, {}).get("failures", 0)) + 1
+
+            open_until = 0.0
+            if self.threshold and failures >= self.threshold:
+                delay = retry_delay(failures - self.threshold + 1)
+                open_until = now + delay
+                LOGGER.warning(
+                    f"{host} failed {failures} times in a row,"
+                    f" skipping it for {delay:.0f}s"
+                )
+
+            self.hosts[host] = {"failures": failures, "open_until": open_until}
+            self._updated.add(host)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, url: str, retry_at: float):
+        super().__init__(
+            f"{CircuitBreaker.host(url)} is failing, skipped until "
+            + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(retry_at))
+        )
+        self.url = url
+        self.retry_at = retry_at
@@ -16,51 +16,59 @@
 # USA.
 
 
+import dataclasses
+import io
 import logging
+from collections.abc import Iterable, Mapping
+from typing import BinaryIO
 
-from feedgen.feed import FeedGenerator
-
-from .parser import ParsedBuffer
+from .parser import ParsedBuffer, ParsedEntry
+from .writer import WRITERS, write_all
 
 LOGGER = logging.getLogger(__name__)
 
 
 class Builder:
-    def build(self, data: ParsedBuffer) -> str:
-        fg = FeedGenerator()
-        fg.id(data.link)
-        fg.link(href=data.link)
-        fg.title(data.title)
-
-        if not data.description:
-            LOGGER.warning(f"Missing 'description' for {data.link}")
-        fg.description(data.description or data.title)
+    def build(
+        self, data: ParsedBuffer, pretty: bool = True, format: str = "rss"
+    ) -> str:
+        buff = io.BytesIO()
+        self.write_formats(data, {format: buff}, pretty=pretty)
 
-        # fg.id("http://lernfunk.de/media/654321")
-        # fg.title("Some Testfeed")
-        # fg.author({"name": "John Doe", "email": "john@example.de"})
-        # fg.link(href="http://example.com", rel="alternate")
-        # fg.logo("http://ex.com/logo.jpg")
-        # fg.subtitle("This is a cool feed!")
-        # fg.link(href="http://larskiesow.de/test.atom", rel="self")
-        # fg.language("en")
+        return buff.getvalue().decode("utf-8")
 
-        for entry in data.entries:
-            fe = fg.add_entry()
-            fe.id(entry.link)
-            fe.link(href=entry.link)
+    def write(
+        self,
+        data: ParsedBuffer,
+        fh: BinaryIO,
+        pretty: bool = True,
+        entries: Iterable[ParsedEntry] | None = None,
+    ) -> None:
+        """
+        Write `data` as RSS into `fh`. Entries are taken from `entries` if
+        given (ie. a stream from `Parser.stream`) instead of `data.entries`.
+        """
+        self.write_formats(data, {"rss": fh}, pretty=pretty, entries=entries)
 
-            if entry.title:
-                fe.title(entry.title)
-            if entry.content:
-                fe.content(entry.content)
-            if entry.image:
-                fe.enclosure(entry.image, type="image", length=0)
-
-        # atomfeed = fg.atom_str(pretty=True)  # Get the ATOM feed as string
-        rssfeed = fg.rss_str(pretty=True)  # Get the RSS feed as string
-
-        return rssfeed.decode("utf-8")
+    def write_formats(
+        self,
+        data: ParsedBuffer,
+        outputs: Mapping[str, BinaryIO],
+        pretty: bool = True,
+        entries: Iterable[ParsedEntry] | None = None,
+    ) -> None:
+        """
+        Like `write` for several formats at once (see `writer.WRITERS`),
+        `outputs` maps each format to its stream. Entries are read once.
+        """
+        if not data.description:
+            LOGGER.warning(f"Missing 'description' for {data.link}")
 
-        # fg.atom_file("atom.xml")  # Write the ATOM feed to a file
-        # fg.rss_file("rss.xml")  # Write the RSS feed to a file
+        # Entries are written in reverse document order, as feedgen's default
+        # "prepend" insertion did, so streams have to be consumed first
+        entries = data.entries if entries is None else list(entries)
+        write_all(
+            [WRITERS[format](fh, pretty=pretty) for format, fh in outputs.items()],
+            dataclasses.replace(data, description=data.description or data.title),
+            entries=reversed(entries),
+        )
@@ -16,49 +16,388 @@
 # USA.
 
 
+from __future__ import annotations
+
+import abc
 import hashlib
+import json
 import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
 from pathlib import Path
 from time import localtime, mktime
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .models import Config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 LOGGER = logging.getLogger(__name__)
 
 
 class Cache:
-    def __init__(self, base_dir: Path, delta: float = 60 * 60 * 2):
+    def __init__(
+        self, base_dir: Path, delta: float = 60 * 60 * 2, store: Store | None = None
+    ):
         self.base = base_dir
         self.delta = delta
+        self.store = store or FilesystemStore(base_dir)
 
-    def _calc_filepath(self, id_: str) -> Path:
-        h = hashlib.sha256(id_.encode("utf-8")).hexdigest()
-        return self.base / h[0] / h[0:2] / h
+    @classmethod
+    def from_config(cls, config: Config) -> Cache:
+        store: Store
+        if config.cache_backend == "sqlite":
+            store = SQLiteStore(
+                config.cache_dir / "cache.sqlite", max_size=config.cache_max_size
+            )
+        else:
+            store = FilesystemStore(config.cache_dir, max_size=config.cache_max_size)
 
-    def get(self, url: str) -> bytes:
-        filepath = self._calc_filepath(url)
+        return cls(config.cache_dir, store=store)
 
-        try:
-            mtime = filepath.stat().st_mtime
-        except FileNotFoundError:
+    def age(self, url: str) -> float:
+        """
+        Seconds since contents for `url` were stored or renewed
+        """
+        mtime = self.store.mtime(url)
+        if mtime is None:
             LOGGER.debug(f"cache miss: {url}")
             raise MissError()
 
-        diff = mktime(localtime()) - mtime
-        if diff >= self.delta:
+        return mktime(localtime()) - mtime
+
+    def get(self, url: str, ttl: float | None = None) -> bytes:
+        if self.age(url) >= (ttl or self.delta):
             LOGGER.debug(f"cache expired: {url}")
             raise MissError()
 
-        ret = filepath.read_bytes()
+        ret, _ = self.store.read(url)
         LOGGER.debug(f"cache hit: {url}")
 
         return ret
 
-    def set(self, url: str, contents: bytes) -> None:
-        filepath = self._calc_filepath(url)
-        filepath.parent.mkdir(parents=True, exist_ok=True)
+    def get_stale(self, url: str) -> tuple[bytes, dict[str, str]]:
+        """
+        Get cached contents and HTTP validators for `url` ignoring its
+        freshness
+        """
+        return self.store.read(url)
 
-        filepath.write_bytes(contents)
+    def set(
+        self, url: str, contents: bytes, validators: dict[str, str] | None = None
+    ) -> None:
+        self.store.write(url, contents, validators or {})
         LOGGER.debug(f"cache save: {url} ({len(contents)} bytes)")
 
+    def touch(self, url: str) -> None:
+        """
+        Mark cached contents for `url` as fresh again
+        """
+        self.store.touch(url)
+        LOGGER.debug(f"cache renew: {url}")
+
+
+class Store(abc.ABC):
+    """
+    Storage used by `Cache`, keys are URLs.
+
+    Stores with a `max_size` (in bytes) evict least recently used entries on
+    `gc()`.
+    """
+
+    def __init__(self, max_size: int | None = None):
+        self.max_size = max_size
+
+    @abc.abstractmethod
+    def mtime(self, key: str) -> float | None:
+        pass
+
+    @abc.abstractmethod
+    def read(self, key: str) -> tuple[bytes, dict[str, str]]:
+        """
+        Returns contents and validators for `key`, raises `MissError` if it's
+        not stored
+        """
+        pass
+
+    @abc.abstractmethod
+    def write(self, key: str, contents: bytes, validators: dict[str, str]) -> None:
+        pass
+
+    @abc.abstractmethod
+    def touch(self, key: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def stats(self) -> dict[str, int]:
+        pass
+
+    @abc.abstractmethod
+    def gc(self) -> int:
+        """
+        Evict entries until the store fits into `max_size`, returns the
+        number of evicted entries
+        """
+        pass
+
+    @abc.abstractmethod
+    def purge(self) -> int:
+        """
+        Remove every entry, returns the number of removed entries
+        """
+        pass
+
+
+class FilesystemStore(Store):
+    """
+    One file per URL (plus an optional .meta file for validators) under a
+    sha256-sharded tree.
+    """
+
+    def __init__(self, base_dir: Path, max_size: int | None = None):
+        super().__init__(max_size)
+        self.base = base_dir
+
+    def _calc_filepath(self, id_: str) -> Path:
+        h = hashlib.sha256(id_.encode("utf-8")).hexdigest()
+        return self.base / h[0] / h[0:2] / h
+
+    def _iter_filepaths(self):
+        for filepath in self.base.glob("?/??/*"):
+            if len(filepath.name) == 64 and not filepath.suffix:
+                yield filepath
+
+    def _remove(self, filepath: Path) -> None:
+        filepath.unlink(missing_ok=True)
+        filepath.with_suffix(".meta").unlink(missing_ok=True)
+
+    def mtime(self, key: str) -> float | None:
+        try:
+            return self._calc_filepath(key).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def read(self, key: str) -> tuple[bytes, dict[str, str]]:
+        filepath = self._calc_filepath(key)
+
+        try:
+            contents = filepath.read_bytes()
+        except FileNotFoundError:
+            raise MissError()
+
+        try:
+            validators = json.loads(filepath.with_suffix(".meta").read_text())
+        except (FileNotFoundError, ValueError):
+            validators = {}
+
+        return contents, validators
+
+    def write(self, key: str, contents: bytes, validators: dict[str, str]) -> None:
+        from .output import write_atomic
+
+        # Several workers can share the store, contents are written before
+        # their validators so a reader never pairs old contents with new
+        # validators
+        filepath = self._calc_filepath(key)
+        write_atomic(filepath, contents)
+
+        metapath = filepath.with_suffix(".meta")
+        if validators:
+            write_atomic(metapath, json.dumps(validators).encode("utf-8"))
+        else:
+            metapath.unlink(missing_ok=True)
+
+    def touch(self, key: str) -> None:
+        os.utime(self._calc_filepath(key))
+
+    def stats(self) -> dict[str, int]:
+        sizes = [x.stat().st_size for x in self._iter_filepaths()]
+        return {"entries": len(sizes), "size": sum(sizes), "stored_size": sum(sizes)}
+
+    def gc(self) -> int:
+        if not self.max_size:
+            return 0
+
+        # Files are read without updating any timestamp, modification time
+        # is the best available approximation of last use
+        files = sorted(
+            ((x.stat(), x) for x in self._iter_filepaths()),
+            key=lambda x: x[0].st_mtime,
+        )
+        total = sum(st.st_size for st, _ in files)
+
+        ret = 0
+        for st, filepath in files:
+            if total <= self.max_size:
+                break
+
+            self._remove(filepath)
+            total = total - st.st_size
+            ret = ret + 1
+
+        return ret
+
+    def purge(self) -> int:
+        ret = 0
+        for filepath in list(self._iter_filepaths()):
+            self._remove(filepath)
+            ret = ret + 1
+
+        return ret
+
+
+class SQLiteStore(Store):
+    """
+    Single file store with compressed contents (zstd if available, zlib
+    otherwise) and LRU eviction.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            contents BLOB NOT NULL,
+            codec TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            validators TEXT,
+            mtime REAL NOT NULL,
+            atime REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime);
+    """
+
+    def __init__(self, filepath: Path, max_size: int | None = None):
+        super().__init__(max_size)
+        self.filepath = filepath
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            filepath, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+
+    @staticmethod
+    def compress(contents: bytes) -> tuple[str, bytes]:
+        if zstandard is not None:
+            return "zstd", zstandard.ZstdCompressor().compress(contents)
+
+        return "zlib", zlib.compress(contents)
+
+    @staticmethod
+    def decompress(codec: str, contents: bytes) -> bytes:
+        if codec == "zlib":
+            return zlib.decompress(contents)
+
+        if codec == "zstd" and zstandard is not None:
+            return zstandard.ZstdDecompressor().decompress(contents)
+
+        if codec == "none":
+            return contents
+
+        raise MissError(f"unsupported codec: {codec}")
+
+    def mtime(self, key: str) -> float | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mtime FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def read(self, key: str) -> tuple[bytes, dict[str, str]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT codec, contents, validators FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                raise MissError()
+
+            self._conn.execute(
+                "UPDATE entries SET atime = ? WHERE key = ?", (time.time(), key)
+            )
+
+        codec, contents, validators = row
+        return self.decompress(codec, contents), json.loads(validators or "{}")
+
+    def write(self, key: str, contents: bytes, validators: dict[str, str]) -> None:
+        codec, stored = self.compress(contents)
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, contents, codec, size, stored_size, validators, mtime, atime) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    stored,
+                    codec,
+                    len(contents),
+                    len(stored),
+                    json.dumps(validators),
+                    now,
+                    now,
+                ),
+            )
+
+    def touch(self, key: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET mtime = ?, atime = ? WHERE key = ?",
+                (now, now, key),
+            )
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            entries, size, stored_size = self._conn.execute(
+                "SELECT COUNT(*), TOTAL(size), TOTAL(stored_size) FROM entries"
+            ).fetchone()
+
+        return {
+            "entries": entries,
+            "size": int(size),
+            "stored_size": int(stored_size),
+            "file_size": self.filepath.stat().st_size,
+        }
+
+    def gc(self) -> int:
+        if not self.max_size:
+            return 0
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, stored_size FROM entries ORDER BY atime DESC"
+            ).fetchall()
+
+            total = 0
+            evict = []
+            for key, stored_size in rows:
+                total = total + stored_size
+                if total > self.max_size:
+                    evict.append((key,))
+
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", evict)
+
+        return len(evict)
+
+    def purge(self) -> int:
+        with self._lock:
+            ret = self._conn.execute("DELETE FROM entries").rowcount
+            self._conn.execute("VACUUM")
+
+        return ret
+
 
 class MissError(Exception):
     pass
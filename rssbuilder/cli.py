@@ -16,63 +16,498 @@
 # USA.
 
 
+from __future__ import annotations
+
 import argparse
 import logging
-import re
+import sys
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from . import NAME, Builder, Config, Fetcher, Parser
-from .cache import Cache, MissError
-from .fixers import ALL as ALL_FIXERS
+from .consts import NAME
+from .metrics import NULL_METRICS, Metrics
 
-logging.basicConfig()
-logging.getLogger(NAME).setLevel(logging.WARNING)
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable, Iterator
+    from concurrent.futures import Executor
 
+    from .lease import Leases
+    from .models import Config, Feed
 
-def slufigy(s: str) -> str:
-    s_ = re.sub(r"[^a-z0-9]", "", s, flags=re.IGNORECASE).lower()
-    if not s_:
-        raise ValueError(s)
+# Only the modules needed by each command are imported, so `--help` or a run
+# where every feed is up to date don't pay for the whole dependency tree.
 
-    return s_
+LOGGER = logging.getLogger(__name__)
 
 
 def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-c", "--config", required=True, type=Path)
+    logging.basicConfig()
+    logging.getLogger(NAME).setLevel(logging.WARNING)
+
+    # -c/--config is accepted both before and after the subcommand
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument("-c", "--config", type=Path, default=argparse.SUPPRESS)
+
+    parser = argparse.ArgumentParser(parents=[config_parser])
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Parse and build feeds using N worker processes",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Rebuild feeds even if their source and settings didn't change",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        type=Path,
+        help="Write per-feed timings and counters to this JSON file",
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        type=Path,
+        help="Write metrics in Prometheus textfile collector format",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Measure peak memory per feed (slow), reported with the metrics",
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    cache_parser = subparsers.add_parser(
+        "cache", parents=[config_parser], help="Inspect or clean the cache"
+    )
+    cache_parser.add_argument("action", choices=["stats", "gc", "purge"])
+
+    explain_parser = subparsers.add_parser(
+        "explain",
+        parents=[config_parser],
+        help="Profile the queries of cached pages, ranking feeds by parse cost",
+    )
+    explain_parser.add_argument(
+        "--feed",
+        action="append",
+        dest="feeds",
+        metavar="NAME",
+        help="Show per query details for this feed (can be repeated)",
+    )
+    explain_parser.add_argument(
+        "--cached-only",
+        action="store_true",
+        help="Don't fetch pages missing from cache, report their feeds as failed",
+    )
+
+    subparsers.add_parser(
+        "daemon",
+        parents=[config_parser],
+        help="Keep running, refreshing each feed when it's due",
+    )
+
+    serve_parser = subparsers.add_parser(
+        "serve", parents=[config_parser], help="Serve feeds over HTTP"
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
 
     args = parser.parse_args()
+    if "config" not in args:
+        parser.error("the following arguments are required: -c/--config")
+
+    if args.command == "serve":
+        serve_command(args)
+        return
+
+    if args.command == "daemon":
+        daemon_command(args)
+        return
+
+    from .models import Config
 
     config = Config.from_filepath(args.config)
-    config.output_dir.mkdir(parents=True, exist_ok=True)
 
-    cache = Cache(config.cache_dir)
+    if args.command == "cache":
+        cache_command(config, args)
+        return
+
+    if args.command == "explain":
+        return explain_command(config, args)
+
+    metrics: Metrics = NULL_METRICS
+    if args.metrics_json or args.metrics_prom or args.trace_memory:
+        metrics = Metrics(trace_memory=args.trace_memory)
+
+    try:
+        failures = build(config, args, metrics)
+    finally:
+        metrics.finish()
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+        if args.metrics_prom:
+            metrics.write_prometheus(args.metrics_prom)
+        if args.trace_memory and not (args.metrics_json or args.metrics_prom):
+            for feed, values in metrics.as_dict()["feeds"].items():
+                if "peak_memory_bytes" in values:
+                    print(f"{feed}: {values['peak_memory_bytes'] / 2**20:.1f} MiB")
+
+    return report_failures(failures, len(config.feeds))
+
+
+def report_failures(failures: dict[str, Exception], total: int) -> int:
+    """
+    Print failed feeds to stderr, returns the exit code for them
+    """
+    if not failures:
+        return 0
+
+    print(f"{len(failures)} of {total} feeds failed:", file=sys.stderr)
+    for name, e in failures.items():
+        print(f"  {name}: {e}", file=sys.stderr)
+
+    return 1
+
+
+def daemon_command(args: argparse.Namespace) -> None:
+    from .daemon import Daemon
+
+    logging.getLogger(NAME).setLevel(logging.INFO)
+
+    try:
+        Daemon(args.config).run()
+    except KeyboardInterrupt:
+        pass
 
-    for feed in config.feeds:
+
+def serve_command(args: argparse.Namespace) -> None:
+    from .models import Config
+    from .server import FeedCache, FeedServer
+
+    logging.getLogger(NAME).setLevel(logging.INFO)
+
+    config = Config.from_filepath(args.config)
+    with FeedServer((args.host, args.port), FeedCache(config)) as httpd:
+        LOGGER.info(f"serving feeds on http://{args.host}:{args.port}/")
         try:
-            buff = cache.get(feed.url)
-        except MissError:
-            buff = Fetcher().fetch(feed.url)
-            cache.set(feed.url, buff)
-
-        parser = Parser(
-            entries=feed.queries.entries,
-            link=feed.queries.link,
-            title=feed.queries.title,
-            image=feed.queries.image,
-            content=feed.queries.content,
-            date=feed.queries.date,
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def cache_command(config: Config, args: argparse.Namespace) -> None:
+    from .cache import Cache
+
+    cache = Cache.from_config(config)
+
+    if args.action == "stats":
+        for k, v in cache.store.stats().items():
+            print(f"{k}: {v}")
+
+    elif args.action == "gc":
+        print(f"evicted: {cache.store.gc()}")
+
+    elif args.action == "purge":
+        print(f"removed: {cache.store.purge()}")
+
+
+def explain_command(config: Config, args: argparse.Namespace) -> int:
+    from .breaker import CircuitBreaker, CircuitOpenError
+    from .cache import Cache, MissError
+    from .explain import explain
+    from .fetcher import Fetcher
+    from .sources import is_host_failure, store_response
+
+    feeds = config.feeds
+    if args.feeds:
+        feeds = [feed for feed in config.feeds if feed.name in args.feeds]
+        if missing := set(args.feeds) - {feed.name for feed in feeds}:
+            print(f"unknown feeds: {', '.join(sorted(missing))}", file=sys.stderr)
+            return 1
+
+    cache = Cache.from_config(config)
+    breaker = CircuitBreaker(
+        config.cache_dir / "circuits.json", threshold=config.breaker_threshold
+    )
+    breaker.load()
+
+    def fetch(fetcher: Fetcher, url: str) -> bytes:
+        if args.cached_only:
+            raise MissError(f"not cached: {url}")
+
+        # Hosts known to be failing would only add their timeouts
+        if not breaker.allow(url):
+            raise CircuitOpenError(url, breaker.retry_at(url))
+
+        LOGGER.info(f"not cached, fetching {url}")
+        try:
+            resp = fetcher.fetch_response(url)
+        except Exception as e:
+            if is_host_failure(e):
+                breaker.failure(url)
+            raise
+
+        breaker.success(url)
+        store_response(cache, url, resp, {})
+        return resp.body
+
+    explanations = []
+    failures: dict[str, Exception] = {}
+    try:
+        with Fetcher.from_config(config) as fetcher:
+            for feed in feeds:
+                try:
+                    try:
+                        buff, _ = cache.get_stale(feed.url)
+                    except MissError:
+                        buff = fetch(fetcher, feed.url)
+
+                    explanations.append(explain(feed, buff))
+
+                except Exception as e:
+                    LOGGER.debug(f"unable to explain {feed.name}: {e!r}")
+                    failures[feed.name] = e
+
+    finally:
+        breaker.save()
+
+    def ms(seconds: float) -> str:
+        return f"{seconds * 1000:.2f}"
+
+    if not args.feeds:
+        print(
+            f"{'feed':<30} {'backend':<11} {'bytes':>9} {'entries':>7}"
+            f" {'parse ms':>9} {'query ms':>9} {'compile ms':>10} {'total ms':>9}"
+        )
+        for x in sorted(explanations, key=lambda x: x.total_time, reverse=True):
+            print(
+                f"{x.feed[:30]:<30} {x.backend:<11} {x.size:>9} {x.entries:>7}"
+                f" {ms(x.parse_time):>9} {ms(x.query_time):>9}"
+                f" {ms(x.compile_time):>10} {ms(x.total_time):>9}"
+            )
+
+        return report_failures(failures, len(feeds))
+
+    for x in explanations:
+        print(f"{x.feed} ({x.backend}, {x.size} bytes, {x.entries} entries)")
+        print(f"parse: {ms(x.parse_time)} ms, queries: {ms(x.query_time)} ms")
+        print(
+            f"{'query':<10} {'selector':<30} {'calls':>6} {'matches':>7}"
+            f" {'total ms':>9} {'mean ms':>8} {'select ms':>9} {'attrs ms':>8}"
+            f" {'extract ms':>10} {'compile ms':>10}"
         )
-        data = parser.parse(buff)
+        for q in sorted(x.queries, key=lambda q: q.total_time, reverse=True):
+            print(
+                f"{q.name:<10} {q.selector[:30]:<30} {q.calls:>6} {q.matches:>7}"
+                f" {ms(q.total_time):>9} {ms(q.mean_time):>8}"
+                f" {ms(q.select_time):>9} {ms(q.filter_time):>8}"
+                f" {ms(q.extract_time):>10} {ms(q.compile_time):>10}"
+            )
+        print()
+
+    return report_failures(failures, len(feeds))
+
+
+def build(
+    config: Config, args: argparse.Namespace, metrics: Metrics = NULL_METRICS
+) -> dict[str, Exception]:
+    """
+    Fetch and build every feed in `config`. Feeds fail independently, the
+    returned dict maps the name of each failed feed to its error.
+
+    With `lease_duration` set, feeds are claimed and built in batches,
+    skipping those claimed by other workers sharing `cache_dir`.
+    """
+    from .breaker import CircuitBreaker
+    from .cache import Cache
+    from .fetcher import FetchPool
+    from .lease import Leases
+    from .sources import complete_refresh, resolve_buffers
+
+    config.output_dir.mkdir(parents=True, exist_ok=True)
+
+    leases = None
+    batches: Iterable[list[Feed]] = [config.feeds]
+    if config.lease_duration:
+        leases = Leases(config.cache_dir / "leases", duration=config.lease_duration)
+        batches = claim_feeds(config.feeds, leases, size=config.max_connections)
+
+    cache = Cache.from_config(config)
+    breaker = CircuitBreaker(
+        config.cache_dir / "circuits.json", threshold=config.breaker_threshold
+    )
+    breaker.load()
+
+    # Worker processes are shared by every batch, started once a batch has
+    # something to build
+    executors: list[Executor] = []
+
+    def executor() -> Executor | None:
+        if args.jobs <= 1:
+            return None
+
+        if not executors:
+            from .pipeline import process_pool
+
+            executors.append(process_pool(args.jobs))
+
+        return executors[0]
+
+    failures: dict[str, Exception] = {}
+    try:
+        with FetchPool.from_config(config) as pool:
+            for feeds in batches:
+                try:
+                    buffers, refreshes, fetch_failures = resolve_buffers(
+                        feeds, cache, pool, metrics, breaker
+                    )
+                    for feed in feeds:
+                        if feed.url in fetch_failures:
+                            failures[feed.name] = fetch_failures[feed.url]
+
+                    # Claims are renewed as work progresses, so only those of
+                    # stuck or dead workers expire
+                    if leases:
+                        leases.renew()
+
+                    failures.update(
+                        build_feeds(
+                            config, args, feeds, buffers, metrics, leases, executor
+                        )
+                    )
+
+                    # Stale buffers have been used already, wait for their
+                    # background revalidation so the next run gets fresh ones
+                    for url, fut in refreshes.items():
+                        complete_refresh(cache, url, fut, buffers, breaker)
+
+                finally:
+                    if leases:
+                        leases.release_all()
+
+    finally:
+        for x in executors:
+            x.shutdown()
+        breaker.save()
+
+    if config.cache_max_size:
+        cache.store.gc()
+
+    return failures
+
+
+def claim_feeds(feeds: list[Feed], leases: Leases, size: int) -> Iterator[list[Feed]]:
+    """
+    Claim `feeds` in batches of up to `size` pages, see
+    `Leases.claim_batches`. Claims are made by URL, feeds sharing a page are
+    built by the same worker.
+    """
+    by_url: dict[str, list[Feed]] = {}
+    for feed in feeds:
+        by_url.setdefault(feed.url, []).append(feed)
+
+    for urls in leases.claim_batches(by_url, size):
+        LOGGER.info(f"claimed {len(urls)} pages")
+        yield [feed for url in urls for feed in by_url[url]]
+
+
+def build_feeds(
+    config: Config,
+    args: argparse.Namespace,
+    feeds: list[Feed],
+    buffers: dict[str, bytes],
+    metrics: Metrics = NULL_METRICS,
+    leases: Leases | None = None,
+    executor: Callable[[], Executor | None] | None = None,
+) -> dict[str, Exception]:
+    """
+    Build feeds with a buffer, skipping those whose outputs are up to date.
+    Returns the errors of the feeds that failed by their name.
+
+    Feeds are built in the executor returned by `executor` if given, it's
+    only called if there's something to build. See `pipeline.build_all`.
+
+    `leases` claims are renewed after each built feed, feeds whose claim was
+    lost are skipped.
+    """
+    from .manifest import Manifest
+    from .output import OutputWriter, output_paths
+
+    manifest = Manifest.from_config(config)
+    manifest.load()
+
+    failures: dict[str, Exception] = {}
+
+    def failed(feed: Feed, e: Exception) -> None:
+        LOGGER.error(f"unable to build {feed.name}: {e!r}")
+        failures[feed.name] = e
+
+    jobs = []
+
+    def lost(feed: Feed) -> bool:
+        # Its claim expired and another worker builds it now
+        return leases is not None and feed.url not in leases.claimed
+
+    for feed in feeds:
+        if feed.url not in buffers or lost(feed):
+            continue
+
+        buff = buffers[feed.url]
+        try:
+            outputs = output_paths(config.output_dir, feed).values()
+        except ValueError as e:
+            failed(feed, e)
+            continue
+
+        if not args.force and manifest.is_current(feed, buff, *outputs):
+            LOGGER.debug(f"up to date: {feed.name}")
+            continue
+
+        jobs.append((feed, buff))
+
+    if not jobs:
+        return failures
+
+    from .pipeline import build_all
+
+    writer = OutputWriter(config.precompress)
+    try:
+        for feed, built in build_all(
+            jobs,
+            workers=args.jobs,
+            pretty=not config.compact_output,
+            history=config.history_path,
+            metrics=metrics,
+            on_error=failed,
+            executor=executor() if executor else None,
+        ):
+            if lost(feed):
+                continue
 
-        for FixerCls in ALL_FIXERS:
-            FixerCls(feed).fix(data)
+            outputs = output_paths(config.output_dir, feed)
+            try:
+                with metrics.timer("write", feed.name):
+                    for format, output in outputs.items():
+                        changed = writer.write(output, built[format])
+                        metrics.add(
+                            "outputs", result="written" if changed else "unchanged"
+                        )
+            except OSError as e:
+                metrics.add("errors", feed=feed.name, stage="write")
+                failed(feed, e)
+                continue
 
-        rss = Builder().build(data)
+            manifest.update(feed, buffers[feed.url], *outputs.values())
+            if leases:
+                leases.renew()
+    finally:
+        manifest.save()
 
-        output = config.output_dir / Path(f"{slufigy(feed.name)}.rss")
-        output.write_text(rss)
+    return failures
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -15,5 +15,24 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
+import functools
 
 NAME = "rssbuilder"
+
+
+@functools.cache
+def _version() -> str:
+    import importlib.metadata
+
+    try:
+        return importlib.metadata.version(NAME)
+    except importlib.metadata.PackageNotFoundError:
+        return "0.0.0"
+
+
+def __getattr__(name: str) -> str:
+    # Reading package metadata is slow, only do it when VERSION is used
+    if name == "VERSION":
+        return _version()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,300 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from pathlib import Path
+
+import pydantic
+import yaml
+
+from .breaker import CircuitBreaker, retry_delay
+from .cache import Cache
+from .fetcher import Fetcher, FetchPool
+from .lease import Leases
+from .manifest import Manifest
+from .models import Config, Feed
+from .output import OutputWriter, output_paths
+from .parser import Parser
+from .pipeline import build_formats, parser_for
+from .sources import complete_refresh, resolve_buffers
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds between checks for config file changes
+RELOAD_INTERVAL = 5.0
+# Relative random variation applied to every delay
+JITTER = 0.1
+
+
+class Scheduler:
+    """
+    Priority queue of feed names ordered by due time.
+
+    Each name has at most one valid due time, rescheduling a name
+    invalidates any previous entry for it.
+    """
+
+    def __init__(self, jitter: float = JITTER):
+        self.jitter = jitter
+        self._heap: list[tuple[float, int, str]] = []
+        self._due: dict[str, float] = {}
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def schedule(self, name: str, delay: float, now: float | None = None) -> float:
+        now = time.monotonic() if now is None else now
+        if delay > 0 and self.jitter:
+            delay = delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+        due = now + delay
+        self._due[name] = due
+        heapq.heappush(self._heap, (due, next(self._seq), name))
+
+        return due
+
+    def discard(self, name: str) -> None:
+        self._due.pop(name, None)
+
+    def next_due(self) -> float | None:
+        while self._heap:
+            due, _, name = self._heap[0]
+            if self._due.get(name) == due:
+                return due
+
+            heapq.heappop(self._heap)
+
+        return None
+
+    def pop_due(self, now: float | None = None) -> list[str]:
+        now = time.monotonic() if now is None else now
+
+        ret = []
+        while (due := self.next_due()) is not None and due <= now:
+            _, _, name = heapq.heappop(self._heap)
+            del self._due[name]
+            ret.append(name)
+
+        return ret
+
+
+class Daemon:
+    """
+    Keeps the config and the feeds' parsers in memory and refreshes each
+    feed when its TTL expires, reloading the config when the file changes.
+    """
+
+    def __init__(self, config_path: Path):
+        self.config_path = config_path
+
+        self.config: Config | None = None
+        self.config_mtime: float | None = None
+        self.feeds: dict[str, Feed] = {}
+        self.parsers: dict[str, Parser] = {}
+        self.failures: dict[str, int] = {}
+        self.fetcher: Fetcher | None = None
+        self.leases: Leases | None = None
+
+        self.scheduler = Scheduler()
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def reload(self) -> bool:
+        """
+        Load the config file if it changed, returns True if it was loaded
+        """
+        try:
+            mtime = self._config_mtime()
+        except FileNotFoundError:
+            LOGGER.error(f"config file {self.config_path} not found")
+            return False
+
+        if mtime == self.config_mtime:
+            return False
+
+        self.config_mtime = mtime
+        try:
+            config = Config.from_filepath(self.config_path)
+        except (OSError, yaml.YAMLError, pydantic.ValidationError) as e:
+            LOGGER.error(f"invalid config, keeping the previous one: {e}")
+            return False
+
+        config.output_dir.mkdir(parents=True, exist_ok=True)
+
+        feeds = {feed.name: feed for feed in config.feeds}
+        for name in self.feeds.keys() - feeds.keys():
+            LOGGER.info(f"feed removed: {name}")
+            self.scheduler.discard(name)
+            self.failures.pop(name, None)
+
+        for name, feed in feeds.items():
+            if self.feeds.get(name) == feed:
+                continue
+
+            # New or changed feeds are refreshed right away
+            LOGGER.info(f"feed scheduled: {name}")
+            self.parsers[name] = parser_for(feed)
+            self.scheduler.schedule(name, 0)
+
+        self.parsers = {name: self.parsers[name] for name in feeds}
+        self.feeds = feeds
+        self.config = config
+        self.cache = Cache.from_config(config)
+        if self.fetcher:
+            self.fetcher.close()
+        self.fetcher = Fetcher.from_config(config)
+        self.writer = OutputWriter(config.precompress)
+        self.manifest = Manifest.from_config(config)
+        self.manifest.load()
+        self.breaker = CircuitBreaker(
+            config.cache_dir / "circuits.json", threshold=config.breaker_threshold
+        )
+        self.breaker.load()
+        self.leases = None
+        if config.lease_duration:
+            self.leases = Leases(
+                config.cache_dir / "leases", duration=config.lease_duration
+            )
+
+        return True
+
+    def _config_mtime(self) -> float:
+        mtime = self.config_path.stat().st_mtime
+
+        # Included feed files count as part of the config
+        if self.config and self.config.include and self.config.include.is_dir():
+            mtime = max(
+                [mtime, self.config.include.stat().st_mtime]
+                + [x.stat().st_mtime for x in self.config.include.iterdir()]
+            )
+
+        return mtime
+
+    def run(self) -> None:
+        self.reload()
+        if self.config is None:
+            raise ValueError(f"unable to load {self.config_path}")
+
+        last_check = time.monotonic()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now - last_check >= RELOAD_INTERVAL:
+                self.reload()
+                last_check = now
+
+            if names := self.scheduler.pop_due(now):
+                self.refresh([self.feeds[name] for name in names])
+                continue
+
+            next_due = self.scheduler.next_due()
+            timeout = RELOAD_INTERVAL if next_due is None else next_due - now
+            self._stop.wait(max(0.0, min(timeout, RELOAD_INTERVAL)))
+
+        if self.fetcher:
+            self.fetcher.close()
+
+    def refresh(self, feeds: list[Feed]) -> None:
+        if self.leases:
+            # Feeds claimed by other workers are checked again on their next
+            # refresh, in case their worker died
+            for feed in feeds:
+                if not self.leases.claim(feed.url):
+                    LOGGER.debug(f"claimed by another worker: {feed.name}")
+                    self.scheduler.schedule(feed.name, feed.ttl)
+            feeds = [feed for feed in feeds if feed.url in self.leases.claimed]
+
+        try:
+            self._refresh(feeds)
+        finally:
+            if self.leases:
+                self.leases.release_all()
+
+    def _refresh(self, feeds: list[Feed]) -> None:
+        assert self.config is not None
+
+        # Connections are kept alive between refreshes
+        with FetchPool.from_config(self.config, self.fetcher) as pool:
+            buffers, refreshes, errors = resolve_buffers(
+                feeds, self.cache, pool, breaker=self.breaker
+            )
+            if self.leases:
+                self.leases.renew()
+
+            for feed in feeds:
+                if self.leases and feed.url not in self.leases.claimed:
+                    # Taken over by another worker, checked again on its next
+                    # refresh
+                    self.scheduler.schedule(feed.name, feed.ttl)
+                    continue
+
+                try:
+                    if feed.url in errors:
+                        raise errors[feed.url]
+
+                    self.build(feed, buffers[feed.url])
+
+                except Exception as e:
+                    failures = self.failures.get(feed.name, 0) + 1
+                    self.failures[feed.name] = failures
+                    delay = retry_delay(failures)
+                    LOGGER.error(
+                        f"refresh failed for {feed.name} ({failures} in a row), "
+                        f"retrying in {delay:.0f}s: {e!r}"
+                    )
+
+                else:
+                    self.failures.pop(feed.name, None)
+                    delay = feed.ttl
+
+                self.scheduler.schedule(feed.name, delay)
+                if self.leases:
+                    self.leases.renew()
+
+            for url, fut in refreshes.items():
+                complete_refresh(self.cache, url, fut, buffers, self.breaker)
+
+        self.manifest.save()
+        self.breaker.save()
+
+    def build(self, feed: Feed, buff: bytes) -> None:
+        assert self.config is not None
+
+        outputs = output_paths(self.config.output_dir, feed)
+        if self.manifest.is_current(feed, buff, *outputs.values()):
+            LOGGER.debug(f"up to date: {feed.name}")
+            return
+
+        built = build_formats(
+            feed,
+            buff,
+            pretty=not self.config.compact_output,
+            parser=self.parsers[feed.name],
+            history=self.config.history_path,
+        )
+        for format, output in outputs.items():
+            self.writer.write(output, built[format])
+        self.manifest.update(feed, buff, *outputs.values())
+        LOGGER.info(f"built {feed.name}")
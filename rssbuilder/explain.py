@@ -0,0 +1,175 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+from .query import FEED_LINK_QUERY, FEED_TITLE_QUERY, CompiledQuery, matches_attrs
+
+if TYPE_CHECKING:
+    from .backends import Backend
+    from .models import Feed
+
+
+@dataclass(slots=True)
+class QueryStats:
+    name: str
+    selector: str
+    compile_time: float = 0.0
+    calls: int = 0
+    matches: int = 0
+    select_time: float = 0.0
+    filter_time: float = 0.0
+    extract_time: float = 0.0
+
+    @property
+    def total_time(self) -> float:
+        return self.select_time + self.filter_time + self.extract_time
+
+    @property
+    def mean_time(self) -> float:
+        return self.total_time / self.calls if self.calls else 0.0
+
+
+@dataclass(slots=True)
+class Explanation:
+    feed: str
+    backend: str
+    size: int
+    parse_time: float = 0.0
+    entries: int = 0
+    queries: list[QueryStats] = field(default_factory=lambda: [])
+
+    @property
+    def compile_time(self) -> float:
+        return sum(x.compile_time for x in self.queries)
+
+    @property
+    def query_time(self) -> float:
+        return sum(x.total_time for x in self.queries)
+
+    @property
+    def total_time(self) -> float:
+        # Compiled queries are cached, compile time isn't paid on every parse
+        return self.parse_time + self.query_time
+
+
+def explain(feed: Feed, buff: bytes) -> Explanation:
+    """
+    Parse `buff` as `Parser` does for `feed`, timing the document parse and
+    every query separately.
+
+    Queries are split into selection, `attributes` filtering (see
+    `query.matches_attrs`) and value extraction. Compile time is measured
+    without the shared compiled queries cache, for soupsieve-based backends
+    it's the selector compilation.
+    """
+    from .pipeline import parser_for
+
+    parser = parser_for(feed)
+    backend = parser.backend
+    plan = parser.plan
+
+    if feed.max_input_bytes:
+        buff = buff[: feed.max_input_bytes]
+
+    sources = {
+        "feed_link": FEED_LINK_QUERY,
+        "feed_title": FEED_TITLE_QUERY,
+        "entries": feed.queries.entries,
+        "link": feed.queries.link,
+        "title": feed.queries.title,
+        "content": feed.queries.content,
+        "date": feed.queries.date,
+        "image": feed.queries.image,
+    }
+
+    ret = Explanation(feed=feed.name or feed.url, backend=backend.name, size=len(buff))
+    stats: dict[str, QueryStats] = {}
+    for name, source in sources.items():
+        if source is None:
+            continue
+
+        selector = source if isinstance(source, str) else source.selector
+        stats[name] = QueryStats(name=name, selector=selector)
+
+        stats[name].compile_time = _compile_time(backend, selector)
+
+    t0 = time.perf_counter()
+    soup = backend.parse(buff, regions=plan.regions if parser.partial else None)
+    ret.parse_time = time.perf_counter() - t0
+
+    _get(stats["feed_link"], soup, plan.feed_link, backend)
+    _get(stats["feed_title"], soup, plan.feed_title, backend)
+
+    entries = _get(stats["entries"], soup, plan.entries, backend, extract=False)
+    ret.entries = len(entries[: feed.max_items] if feed.max_items else entries)
+    for tag in entries[: ret.entries]:
+        for name in ["link", "title", "content", "date", "image"]:
+            if (query := getattr(plan, name)) is not None:
+                _get(stats[name], tag, query, backend)
+
+    ret.queries = list(stats.values())
+    return ret
+
+
+def _compile_time(backend: Backend, selector: str) -> float:
+    from .backends import SoupBackend
+
+    # soupsieve keeps its own cache of compiled selectors, a cold compile is
+    # measured
+    if isinstance(backend, SoupBackend):
+        import soupsieve
+
+        soupsieve.purge()
+
+    t0 = time.perf_counter()
+    backend.compile(selector)
+    return time.perf_counter() - t0
+
+
+def _get(
+    stats: QueryStats,
+    node: Any,
+    query: CompiledQuery,
+    backend: Backend,
+    extract: bool = True,
+) -> list[Any]:
+    # Same steps as `query.get`, each one timed on its own
+    t0 = time.perf_counter()
+    tags = backend.select(node, query.pattern)
+    t1 = time.perf_counter()
+    if query.attributes:
+        tags = [tag for tag in tags if matches_attrs(tag, query.attributes, backend)]
+    t2 = time.perf_counter()
+    if extract and query.target:
+        values = [backend.attrs(tag).get(query.target) for tag in tags]
+    elif extract:
+        values = [backend.text(tag) for tag in tags]
+    t3 = time.perf_counter()
+
+    stats.calls = stats.calls + 1
+    stats.matches = stats.matches + len(tags)
+    stats.select_time = stats.select_time + (t1 - t0)
+    stats.filter_time = stats.filter_time + (t2 - t1)
+    stats.extract_time = stats.extract_time + (t3 - t2)
+
+    return values if extract else tags
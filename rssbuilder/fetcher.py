@@ -16,15 +16,475 @@
 # USA.
 
 
+from __future__ import annotations
+
+import http.client
 import logging
-from urllib import request
+import ssl
+import threading
+import time
+import zlib
+from collections import deque
+from collections.abc import Iterable, Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+from urllib import parse, request
+
+from .consts import NAME, VERSION
+
+if TYPE_CHECKING:
+    from .models import Config
+
+try:
+    import brotli
+
+    # Bounded output (output_buffer_limit) is only available since brotli 1.2
+    brotli.Decompressor().process(b"", output_buffer_limit=1)
+except (ImportError, TypeError):
+    brotli = None
 
 LOGGER = logging.getLogger(__name__)
 
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli else "gzip, deflate"
+CHUNK_SIZE = 64 * 1024
+MAX_REDIRECTS = 5
+REDIRECT_CODES = {301, 302, 303, 307, 308}
+
+
+@dataclass
+class Response:
+    body: bytes
+    etag: str | None = None
+    last_modified: str | None = None
+    not_modified: bool = False
+    elapsed: float = 0.0
+
+    @property
+    def validators(self) -> dict[str, str]:
+        ret = {}
+        if self.etag:
+            ret["etag"] = self.etag
+        if self.last_modified:
+            ret["last_modified"] = self.last_modified
+
+        return ret
+
 
 class Fetcher:
+    """
+    HTTP client reusing connections to each host (keep-alive).
+
+    Responses are requested compressed and decoded while they are read.
+    `connect_timeout` and `read_timeout` bound every connection attempt and
+    every socket read, and bodies larger than `max_body_size` bytes (once
+    decoded) are rejected. Fetchers are thread-safe.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 30.0,
+        max_body_size: int = 16 * 1024 * 1024,
+        max_idle_per_host: int = 4,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_body_size = max_body_size
+        self.max_idle_per_host = max_idle_per_host
+
+        self._lock = threading.Lock()
+        self._idle: dict[tuple[str, str], list[http.client.HTTPConnection]] = {}
+        self._ssl_context = ssl.create_default_context()
+
+    @classmethod
+    def from_config(cls, config: Config) -> Fetcher:
+        return cls(
+            connect_timeout=config.connect_timeout,
+            read_timeout=config.read_timeout,
+            max_body_size=config.max_body_size,
+        )
+
+    def __enter__(self) -> Fetcher:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            self._idle.clear()
+
+        for conn in idle:
+            conn.close()
+
     def fetch(self, url: str) -> bytes:
-        with request.urlopen(url) as fh:
-            ret = fh.read()
+        return self.fetch_response(url).body
+
+    def fetch_response(
+        self, url: str, validators: Mapping[str, str] | None = None
+    ) -> Response:
+        validators = validators or {}
+
+        headers = {
+            "User-Agent": f"{NAME}/{VERSION}",
+            "Accept-Encoding": ACCEPT_ENCODING,
+        }
+        if etag := validators.get("etag"):
+            headers["If-None-Match"] = etag
+        if last_modified := validators.get("last_modified"):
+            headers["If-Modified-Since"] = last_modified
+
+        start = time.perf_counter()
+        for _ in range(MAX_REDIRECTS + 1):
+            status, resp_headers, body = self._request(url, headers)
+            if status in REDIRECT_CODES and "Location" in resp_headers:
+                url = parse.urljoin(url, resp_headers["Location"])
+                LOGGER.debug(f"redirected to {url}")
+                continue
+
+            break
+
+        else:
+            raise TooManyRedirectsError(url)
+
+        if status == 304:
+            LOGGER.debug(f"not modified: {url}")
+            return Response(
+                body=b"",
+                etag=resp_headers.get("ETag") or etag,
+                last_modified=resp_headers.get("Last-Modified") or last_modified,
+                not_modified=True,
+                elapsed=time.perf_counter() - start,
+            )
+
+        if not 200 <= status < 300:
+            raise HTTPStatusError(url, status)
+
+        return Response(
+            body=body,
+            etag=resp_headers.get("ETag"),
+            last_modified=resp_headers.get("Last-Modified"),
+            elapsed=time.perf_counter() - start,
+        )
+
+    def _request(
+        self, url: str, headers: dict[str, str]
+    ) -> tuple[int, http.client.HTTPMessage, bytes]:
+        parts = parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"unsupported URL scheme: {url}")
+
+        key = (parts.scheme, parts.netloc.lower())
+        target = parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        if key[0] == "http" and self._proxy_for(parts):
+            # Plain HTTP proxies get the absolute URL
+            target = parse.urlunsplit(parts._replace(fragment=""))
+
+        conn, reused = self._acquire(key, parts)
+        try:
+            try:
+                conn.request("GET", target, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                # The server may have closed an idle connection meanwhile
+                if not reused:
+                    raise
+
+                conn.close()
+                conn, _ = self._acquire(key, parts, reuse=False)
+                conn.request("GET", target, headers=headers)
+                resp = conn.getresponse()
+
+            body = self._read_body(url, resp)
+
+        except BaseException:
+            conn.close()
+            raise
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+
+        return resp.status, resp.headers, body
+
+    def _proxy_for(self, parts: parse.SplitResult) -> str | None:
+        proxy = request.getproxies().get(parts.scheme)
+        if not proxy or request.proxy_bypass(parts.hostname or ""):
+            return None
+
+        return proxy
+
+    def _acquire(
+        self, key: tuple[str, str], parts: parse.SplitResult, reuse: bool = True
+    ) -> tuple[http.client.HTTPConnection, bool]:
+        if reuse:
+            with self._lock:
+                if idle := self._idle.get(key):
+                    return idle.pop(), True
+
+        host, port = parts.hostname or "", parts.port
+        tunnel = None
+        if proxy := self._proxy_for(parts):
+            proxy_parts = parse.urlsplit(proxy)
+            if parts.scheme == "https":
+                tunnel = (host, port)
+            host, port = proxy_parts.hostname or "", proxy_parts.port
+
+        conn: http.client.HTTPConnection
+        if parts.scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=self.connect_timeout, context=self._ssl_context
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+
+        if tunnel:
+            conn.set_tunnel(*tunnel)
+
+        conn.connect()
+        assert conn.sock is not None
+        conn.sock.settimeout(self.read_timeout)
+
+        return conn, False
+
+    def _release(self, key: tuple[str, str], conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+
+        conn.close()
+
+    def _read_body(self, url: str, resp: http.client.HTTPResponse) -> bytes:
+        length = resp.getheader("Content-Length")
+        if length and length.isdigit() and int(length) > self.max_body_size:
+            raise BodyTooLargeError(url, self.max_body_size)
+
+        encoding = (resp.getheader("Content-Encoding") or "identity").strip().lower()
+        decoder = _decoder_for(encoding)
+
+        chunks = []
+        size = 0
+        while chunk := resp.read(CHUNK_SIZE):
+            # Ask for one byte over the limit so oversized bodies are detected
+            # without decoding them completely
+            chunk = decoder(chunk, self.max_body_size - size + 1)
+            size += len(chunk)
+            if size > self.max_body_size:
+                raise BodyTooLargeError(url, self.max_body_size)
+
+            chunks.append(chunk)
+
+        return b"".join(chunks)
 
+
+def _decoder_for(encoding: str):
+    if encoding in ("identity", ""):
+        return lambda data, max_length: data
+
+    if encoding in ("gzip", "x-gzip"):
+        return _ZlibDecoder(16 + zlib.MAX_WBITS)
+
+    if encoding == "deflate":
+        return _ZlibDecoder(zlib.MAX_WBITS, raw_fallback=True)
+
+    if encoding == "br" and brotli:
+        return _BrotliDecoder()
+
+    raise ValueError(f"unsupported content encoding: {encoding}")
+
+
+class _ZlibDecoder:
+    def __init__(self, wbits: int, raw_fallback: bool = False):
+        self.wbits = wbits
+        # Some servers send raw deflate streams instead of zlib ones
+        self.raw_fallback = raw_fallback
+        self._obj = zlib.decompressobj(wbits)
+
+    def __call__(self, data: bytes, max_length: int) -> bytes:
+        try:
+            ret = self._obj.decompress(data, max_length)
+        except zlib.error:
+            if not self.raw_fallback:
+                raise
+
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            ret = self._obj.decompress(data, max_length)
+
+        # The stream format is settled by its first chunk
+        self.raw_fallback = False
         return ret
+
+
+class _BrotliDecoder:
+    def __init__(self):
+        self._obj = brotli.Decompressor()
+
+    def __call__(self, data: bytes, max_length: int) -> bytes:
+        return self._obj.process(data, output_buffer_limit=max_length)
+
+
+@dataclass
+class _Request:
+    url: str
+    validators: Mapping[str, str] | None
+    future: Future[Response]
+
+
+class FetchPool:
+    """
+    Fetch several URLs concurrently.
+
+    At most `max_workers` requests are in flight at the same time and, among
+    them, no more than `max_per_host` target the same host. Requests over the
+    per-host limit wait in a queue for their host, without taking a worker,
+    so a busy host doesn't delay the others. Pools hold worker threads until
+    `close()` is called (or the `with` block is left).
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        max_per_host: int = 2,
+        fetcher: Fetcher | None = None,
+    ):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.fetcher = fetcher or Fetcher()
+        self._owns_fetcher = fetcher is None
+
+        # Reentrant, a request can finish as soon as it's started
+        self._lock = threading.RLock()
+        self._idle = threading.Condition(self._lock)
+        self._active: dict[str, int] = {}
+        self._queues: dict[str, deque[_Request]] = {}
+        self._executor: ThreadPoolExecutor | None = None
+
+    @classmethod
+    def from_config(cls, config: Config, fetcher: Fetcher | None = None) -> FetchPool:
+        pool = cls(
+            max_workers=config.max_connections,
+            max_per_host=config.max_connections_per_host,
+            fetcher=fetcher or Fetcher.from_config(config),
+        )
+        pool._owns_fetcher = fetcher is None
+
+        return pool
+
+    def __enter__(self) -> FetchPool:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        # Queued requests are started by finishing ones, wait for all of them
+        # before the executor stops accepting work
+        with self._idle:
+            self._idle.wait_for(lambda: not any(self._active.values()))
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        if self._owns_fetcher:
+            self.fetcher.close()
+
+    def _fetch(self, url: str, validators: Mapping[str, str] | None) -> Response:
+        LOGGER.debug(f"fetch: {url}")
+        return self.fetcher.fetch_response(url, validators)
+
+    def _start(self, host: str, req: _Request) -> None:
+        # Called with the lock held and a slot of `host` taken for `req`
+        assert self._executor is not None
+
+        if not req.future.set_running_or_notify_cancel():
+            self._release(host)
+            return
+
+        inner = self._executor.submit(self._fetch, req.url, req.validators)
+        inner.add_done_callback(lambda inner: self._finish(host, req, inner))
+
+    def _finish(self, host: str, req: _Request, inner: Future[Response]) -> None:
+        if (e := inner.exception()) is not None:
+            req.future.set_exception(e)
+        else:
+            req.future.set_result(inner.result())
+
+        with self._lock:
+            self._release(host)
+
+    def _release(self, host: str) -> None:
+        # Called with the lock held, the slot goes to the next queued request
+        if queue := self._queues.get(host):
+            self._start(host, queue.popleft())
+            return
+
+        self._active[host] -= 1
+        self._idle.notify_all()
+
+    def submit(
+        self, url: str, validators: Mapping[str, str] | None = None
+    ) -> Future[Response]:
+        host = parse.urlsplit(url).netloc.lower()
+        req = _Request(url, validators, Future())
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+            if self._active.get(host, 0) < self.max_per_host:
+                self._active[host] = self._active.get(host, 0) + 1
+                self._start(host, req)
+            else:
+                self._queues.setdefault(host, deque()).append(req)
+
+        return req.future
+
+    def fetch_all(
+        self,
+        urls: Iterable[str],
+        validators: Mapping[str, Mapping[str, str]] | None = None,
+    ) -> dict[str, Response]:
+        """
+        Fetch `urls` concurrently, `validators` maps URLs to the ETag and
+        Last-Modified values of a previous response (see `Response`).
+        """
+        validators = validators or {}
+
+        # Preserve order while dropping duplicates, the same page can be used
+        # by more than one feed
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+
+        futures = {url: self.submit(url, validators.get(url)) for url in urls}
+
+        return {url: fut.result() for url, fut in futures.items()}
+
+
+class FetchError(Exception):
+    def __init__(self, url: str, message: str):
+        super().__init__(f"{url}: {message}")
+        self.url = url
+
+
+class HTTPStatusError(FetchError):
+    def __init__(self, url: str, status: int):
+        super().__init__(url, f"HTTP {status}")
+        self.status = status
+
+
+class TooManyRedirectsError(FetchError):
+    def __init__(self, url: str):
+        super().__init__(url, f"more than {MAX_REDIRECTS} redirects")
+
+
+class BodyTooLargeError(FetchError):
+    def __init__(self, url: str, max_size: int):
+        super().__init__(url, f"body larger than {max_size} bytes")
+        self.max_size = max_size
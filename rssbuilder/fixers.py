@@ -17,9 +17,11 @@
 
 
 import abc
+import dataclasses
+from collections.abc import Iterable, Iterator
 
 from .models import FeedInfo
-from .parser import ParsedBuffer
+from .parser import ParsedBuffer, ParsedEntry
 
 
 class Fixer:
@@ -30,6 +32,31 @@ class Fixer:
     def fix(self, data: ParsedBuffer):
         pass
 
+    def fix_feed(self, data: ParsedBuffer) -> None:
+        """
+        Fix feed fields of `data` (ignoring its entries)
+        """
+        entries, data.entries = data.entries, []
+        try:
+            self.fix(data)
+        finally:
+            data.entries = entries
+
+    def fix_stream(
+        self, data: ParsedBuffer, entries: Iterable[ParsedEntry]
+    ) -> Iterator[ParsedEntry]:
+        """
+        Fix entries one at a time as they are consumed.
+
+        By default `fix` is called with a copy of `data` holding only the
+        current entry, so fixers written for whole buffers work unchanged.
+        """
+        view = dataclasses.replace(data, entries=[])
+        for entry in entries:
+            view.entries = [entry]
+            self.fix(view)
+            yield from view.entries
+
 
 class CanonicalURLs(Fixer):
     def fix(self, data: ParsedBuffer):
@@ -57,3 +84,21 @@ class FeedFiller(Fixer):
 
 
 ALL = [FeedFiller, CanonicalURLs]
+
+
+def fix_stream(
+    fixers: Iterable[Fixer], data: ParsedBuffer, entries: Iterable[ParsedEntry]
+) -> Iterator[ParsedEntry]:
+    """
+    Apply `fixers` to the feed fields of `data` right away and to `entries`
+    lazily, each entry goes through every fixer before the next one is read.
+    """
+    fixers = list(fixers)
+    for fixer in fixers:
+        fixer.fix_feed(data)
+
+    stream = iter(entries)
+    for fixer in fixers:
+        stream = fixer.fix_stream(data, stream)
+
+    return stream
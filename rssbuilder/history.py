@@ -0,0 +1,133 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+import sqlite3
+import time
+from collections.abc import Iterable
+from pathlib import Path
+
+from .parser import ParsedEntry
+
+LOGGER = logging.getLogger(__name__)
+
+
+class EntryStore:
+    """
+    Persistent record of every entry seen for each feed, keyed by feed name
+    and entry link.
+
+    Builds merge the entries currently on the page and emit a window of the
+    most recent ones, so entries scrolled out of the page are kept.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            feed TEXT NOT NULL,
+            link TEXT NOT NULL,
+            title TEXT,
+            content TEXT,
+            image TEXT,
+            date TEXT,
+            position INTEGER NOT NULL,
+            first_seen REAL NOT NULL,
+            last_seen REAL NOT NULL,
+            PRIMARY KEY (feed, link)
+        );
+        CREATE INDEX IF NOT EXISTS entries_window
+            ON entries (feed, first_seen DESC, position);
+    """
+
+    def __init__(self, filepath: Path):
+        self.filepath = filepath
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+
+        self._conn = sqlite3.connect(filepath, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def __enter__(self) -> "EntryStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def merge(
+        self, feed: str, entries: Iterable[ParsedEntry], now: float | None = None
+    ) -> None:
+        """
+        Insert new entries and refresh already known ones. First-seen time and
+        position of known entries are kept.
+        """
+        now = time.time() if now is None else now
+
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO entries "
+                "(feed, link, title, content, image, date, position, first_seen, "
+                "last_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (feed, link) DO UPDATE SET "
+                "title = excluded.title, content = excluded.content, "
+                "image = excluded.image, date = excluded.date, "
+                "last_seen = excluded.last_seen",
+                (
+                    (
+                        feed,
+                        entry.link,
+                        entry.title,
+                        entry.content,
+                        entry.image,
+                        entry.date,
+                        idx,
+                        now,
+                        now,
+                    )
+                    for idx, entry in enumerate(entries)
+                ),
+            )
+
+    def window(
+        self,
+        feed: str,
+        max_items: int | None = None,
+        max_age: float | None = None,
+        now: float | None = None,
+    ) -> list[ParsedEntry]:
+        """
+        Most recently discovered entries for `feed`, newest first and in page
+        order for entries discovered together
+        """
+        now = time.time() if now is None else now
+        since = now - max_age if max_age else 0
+
+        rows = self._conn.execute(
+            "SELECT link, title, content, image, date FROM entries "
+            "WHERE feed = ? AND first_seen >= ? "
+            "ORDER BY first_seen DESC, position "
+            "LIMIT ?",
+            (feed, since, max_items or -1),
+        )
+
+        return [
+            ParsedEntry(link=link, title=title, content=content, image=image, date=date)
+            for link, title, content, image, date in rows
+        ]
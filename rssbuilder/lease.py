@@ -0,0 +1,175 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import hashlib
+import logging
+import os
+import socket
+import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Leases:
+    """
+    Exclusive claims shared by several processes, or hosts, through a common
+    directory (which may live on a network filesystem).
+
+    Each claim is a file created with O_EXCL, so only one worker gets it. A
+    claim lasts `duration` seconds since its file was created or renewed;
+    once expired any worker can take it over, which recovers claims left
+    behind by crashed workers.
+    """
+
+    def __init__(self, base_dir: Path, duration: float = 900, owner: str = ""):
+        self.base = base_dir
+        self.duration = duration
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.claimed: set[str] = set()
+
+    def _calc_filepath(self, key: str) -> Path:
+        h = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.base / f"{h}.lease"
+
+    def _owner(self, filepath: Path) -> str | None:
+        try:
+            return filepath.read_text().split("\n", 1)[0]
+        except FileNotFoundError:
+            return None
+
+    def _expired(self, filepath: Path, now: float) -> bool:
+        try:
+            return filepath.stat().st_mtime + self.duration <= now
+        except FileNotFoundError:
+            return True
+
+    def claim(self, key: str, now: float | None = None) -> bool:
+        """
+        Claim `key` for this worker, returns False if another one holds it
+        """
+        now = time.time() if now is None else now
+        filepath = self._calc_filepath(key)
+        if key in self.claimed:
+            if self._owner(filepath) == self.owner:
+                return True
+
+            self._lost(key)
+
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+
+        try:
+            fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            if not self._take_over(filepath, now):
+                return False
+
+            return self.claim(key, now)
+
+        with os.fdopen(fd, "w") as fh:
+            fh.write(f"{self.owner}\n{key}\n")
+        os.utime(filepath, (now, now))
+
+        self.claimed.add(key)
+        return True
+
+    def _take_over(self, filepath: Path, now: float) -> bool:
+        """
+        Remove the lease at `filepath` if it expired, returns True if it's
+        gone
+        """
+        if not self._expired(filepath, now):
+            return False
+
+        # Renaming is atomic, only one of the workers racing for an expired
+        # lease gets to remove it
+        stale = filepath.with_name(f"{filepath.name}.{self.owner}.expired")
+        try:
+            os.rename(filepath, stale)
+        except FileNotFoundError:
+            return True
+
+        if not self._expired(stale, now):
+            # Someone else took it over in between, give theirs back
+            try:
+                os.link(stale, filepath)
+            except FileExistsError:
+                pass
+            stale.unlink()
+            return False
+
+        LOGGER.warning(f"lease of {self._owner(stale)} expired: {filepath.name}")
+        stale.unlink()
+        return True
+
+    def claim_batches(self, keys: Iterable[str], size: int) -> Iterator[list[str]]:
+        """
+        Claim `keys` in batches of up to `size`, skipping those held by other
+        workers. Each batch is claimed once the previous one was consumed, so
+        workers going through the same keys split them between themselves
+        instead of the first one taking them all.
+        """
+        batch = []
+        for key in keys:
+            if not self.claim(key):
+                LOGGER.debug(f"claimed by another worker: {key}")
+                continue
+
+            batch.append(key)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def renew(self, now: float | None = None) -> None:
+        """
+        Extend every claim of this worker for another `duration` seconds.
+        Claims taken over by other workers are dropped from `claimed`.
+        """
+        now = time.time() if now is None else now
+        for key in list(self.claimed):
+            filepath = self._calc_filepath(key)
+            # Expired and taken over by another worker meanwhile, its lease
+            # must be left alone
+            if self._owner(filepath) != self.owner:
+                self._lost(key)
+                continue
+
+            try:
+                os.utime(filepath, (now, now))
+            except FileNotFoundError:
+                self._lost(key)
+
+    def _lost(self, key: str) -> None:
+        LOGGER.warning(f"lease lost: {key}")
+        self.claimed.discard(key)
+
+    def release(self, key: str) -> None:
+        self.claimed.discard(key)
+
+        filepath = self._calc_filepath(key)
+        # It could have expired and been claimed by another worker
+        if self._owner(filepath) == self.owner:
+            filepath.unlink(missing_ok=True)
+
+    def release_all(self) -> None:
+        for key in list(self.claimed):
+            self.release(key)
@@ -0,0 +1,98 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any
+
+from .consts import VERSION
+from .models import Config, Feed
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Manifest:
+    """
+    Records what every output file was built from so unchanged feeds can be
+    skipped on the next run.
+
+    `settings` are the config-level options affecting every output, changing
+    any of them invalidates all records.
+    """
+
+    def __init__(self, filepath: Path, settings: dict[str, Any] | None = None):
+        self.filepath = filepath
+        self.settings = hashlib.sha256(
+            json.dumps(settings or {}, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        self.entries: dict[str, dict[str, str]] = {}
+        self._updated: set[str] = set()
+
+    @classmethod
+    def from_config(cls, config: Config) -> "Manifest":
+        return cls(
+            config.cache_dir / "manifest.json",
+            settings={
+                "compact_output": config.compact_output,
+                "precompress": sorted(config.precompress),
+            },
+        )
+
+    def load(self) -> None:
+        try:
+            self.entries = json.loads(self.filepath.read_text())
+        except FileNotFoundError:
+            self.entries = {}
+        except ValueError:
+            LOGGER.warning(f"Ignoring invalid manifest {self.filepath}")
+            self.entries = {}
+
+    def save(self) -> None:
+        from .output import write_atomic
+
+        # Other workers could have saved their records since it was loaded
+        updated = {k: self.entries[k] for k in self._updated}
+        self.load()
+        self.entries.update(updated)
+        self._updated.clear()
+
+        write_atomic(self.filepath, json.dumps(self.entries, indent=2).encode("utf-8"))
+
+    def _calc_record(self, feed: Feed, buff: bytes) -> dict[str, str]:
+        return {
+            "source": hashlib.sha256(buff).hexdigest(),
+            "feed": hashlib.sha256(feed.model_dump_json().encode("utf-8")).hexdigest(),
+            "settings": self.settings,
+            "version": VERSION,
+        }
+
+    def is_current(self, feed: Feed, buff: bytes, *outputs: Path) -> bool:
+        record = self._calc_record(feed, buff)
+
+        return all(
+            output.exists() and self.entries.get(str(output.absolute())) == record
+            for output in outputs
+        )
+
+    def update(self, feed: Feed, buff: bytes, *outputs: Path) -> None:
+        record = self._calc_record(feed, buff)
+        for output in outputs:
+            self.entries[str(output.absolute())] = record
+            self._updated.add(str(output.absolute()))
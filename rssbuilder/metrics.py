@@ -0,0 +1,184 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import contextlib
+import json
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+from .consts import NAME
+
+Labels = tuple[tuple[str, str], ...]
+
+HELP = {
+    "stage_seconds": "Time spent per feed and stage",
+    "entries": "Entries parsed per feed",
+    "fetched_bytes": "Bytes downloaded per feed",
+    "cache": "Cache lookups by result",
+    "errors": "Errors per feed and stage",
+    "outputs": "Output files by result (written or unchanged)",
+    "peak_memory_bytes": "Peak memory allocated by Python while building a feed",
+    "run_seconds": "Duration of the last run",
+    "last_run_timestamp_seconds": "End time of the last run",
+}
+
+
+class Metrics:
+    """
+    Counters and per-stage timings for a run.
+
+    Values are sums keyed by metric name and labels, so they can be merged
+    across processes with `merge()`. With `trace_memory`, peak memory per
+    feed is measured with tracemalloc (which slows builds down noticeably and
+    doesn't see memory allocated by C libraries like libxml2).
+    """
+
+    enabled = True
+
+    def __init__(self, trace_memory: bool = False):
+        self.started = time.time()
+        self.trace_memory = trace_memory
+        self.values: dict[tuple[str, Labels], float] = {}
+
+    def add(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self.values[key] = self.values.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, feed: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(
+                "stage_seconds", time.perf_counter() - start, feed=feed, stage=stage
+            )
+
+    @contextlib.contextmanager
+    def memory(self, feed: str) -> Iterator[None]:
+        if not self.trace_memory:
+            yield
+            return
+
+        import tracemalloc
+
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            if started:
+                tracemalloc.stop()
+            self.add("peak_memory_bytes", peak - base, feed=feed)
+
+    def merge(self, values: dict[tuple[str, Labels], float]) -> None:
+        for (name, labels), value in values.items():
+            self.add(name, value, **dict(labels))
+
+    def finish(self) -> None:
+        now = time.time()
+        self.values[("run_seconds", ())] = now - self.started
+        self.values[("last_run_timestamp_seconds", ())] = now
+
+    def as_dict(self) -> dict:
+        feeds: dict[str, dict] = {}
+        totals: dict[str, dict] = {}
+
+        for (name, labels), value in sorted(self.values.items()):
+            labels_ = dict(labels)
+            if feed := labels_.pop("feed", None):
+                target = feeds.setdefault(feed, {})
+            else:
+                target = totals
+
+            if "stage" in labels_:
+                target.setdefault(name, {})[labels_.pop("stage")] = value
+            elif labels_:
+                key = ",".join(f"{k}={v}" for k, v in labels_.items())
+                target.setdefault(name, {})[key] = value
+            else:
+                target[name] = value
+
+        return {"started": self.started, "totals": totals, "feeds": feeds}
+
+    def as_prometheus(self, prefix: str = NAME) -> str:
+        lines = []
+        seen = set()
+
+        for (name, labels), value in sorted(self.values.items()):
+            metric = f"{prefix}_{name}"
+            if name not in seen:
+                seen.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {metric} {HELP[name]}")
+                lines.append(f"# TYPE {metric} gauge")
+
+            if labels:
+                labels_str = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels)
+                lines.append(f"{metric}{{{labels_str}}} {value}")
+            else:
+                lines.append(f"{metric} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, filepath: Path) -> None:
+        from .output import write_atomic
+
+        write_atomic(
+            filepath, (json.dumps(self.as_dict(), indent=2) + "\n").encode("utf-8")
+        )
+
+    def write_prometheus(self, filepath: Path) -> None:
+        # node-exporter's textfile collector may read the file at any time
+        from .output import write_atomic
+
+        write_atomic(filepath, self.as_prometheus().encode("utf-8"))
+
+
+class NullMetrics(Metrics):
+    """
+    Disabled metrics, every operation is a no-op
+    """
+
+    enabled = False
+
+    def add(self, name: str, value: float = 1, **labels: str) -> None:
+        pass
+
+    def timer(self, stage: str, feed: str):  # type: ignore[override]
+        return _NULL_CONTEXT
+
+    def memory(self, feed: str):  # type: ignore[override]
+        return _NULL_CONTEXT
+
+    def merge(self, values: dict[tuple[str, Labels], float]) -> None:
+        pass
+
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+NULL_METRICS = NullMetrics()
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -21,12 +21,12 @@ from __future__ import annotations
 import io
 import logging
 from pathlib import Path
-from typing import Any
+from typing import Any, Literal
 
-import platformdirs
 import pydantic
 import yaml
 
+from .backends import DEFAULT_BACKEND, BackendName
 from .consts import NAME
 
 LOGGER = logging.getLogger(__name__)
@@ -37,31 +37,100 @@ except AttributeError:
     YAML_LOADER = yaml.Loader
 
 
+OutputFormat = Literal["rss", "atom", "json"]
+
+
+def user_cache_path() -> Path:
+    import platformdirs
+
+    return Path(platformdirs.user_cache_path(NAME))
+
+
 class Config(pydantic.BaseModel):
     model_config = pydantic.ConfigDict(extra="forbid")
 
     feeds: list[Feed] = []
+    include: Path | None = None
     output_dir: Path
-    cache_dir: Path = Path(platformdirs.user_cache_path(NAME))
+    cache_dir: Path = pydantic.Field(default_factory=user_cache_path)
+    cache_backend: Literal["filesystem", "sqlite"] = "filesystem"
+    cache_max_size: pydantic.PositiveInt | None = None
+    ttl: pydantic.PositiveInt = 60 * 60 * 2
+    stale_while_revalidate: pydantic.NonNegativeInt = 0
+    stale_if_error: pydantic.NonNegativeInt = 0
+    history_items: pydantic.PositiveInt | None = None
+    history_days: pydantic.PositiveInt | None = None
+    max_items: pydantic.PositiveInt | None = None
+    formats: list[OutputFormat] = pydantic.Field(default=["rss"], min_length=1)
+    precompress: list[Literal["gzip", "br"]] = []
+    breaker_threshold: pydantic.NonNegativeInt = 3
+    lease_duration: pydantic.PositiveInt | None = None
+    max_connections: pydantic.PositiveInt = 8
+    max_connections_per_host: pydantic.PositiveInt = 2
+    connect_timeout: pydantic.PositiveFloat = 10
+    read_timeout: pydantic.PositiveFloat = 30
+    max_body_size: pydantic.PositiveInt = 16 * 1024 * 1024
+    backend: BackendName = DEFAULT_BACKEND
+    partial_parse: bool = False
+    low_memory: bool = False
+    max_input_bytes: pydantic.PositiveInt | None = None
+    compact_output: bool = False
+
+    @pydantic.model_validator(mode="after")
+    def fill_feed_defaults(self) -> Config:
+        for feed in self.feeds:
+            feed.backend = feed.backend or self.backend
+            if feed.partial_parse is None:
+                feed.partial_parse = self.partial_parse
+            if feed.low_memory is None:
+                feed.low_memory = self.low_memory
+            feed.max_input_bytes = feed.max_input_bytes or self.max_input_bytes
+            feed.ttl = feed.ttl or self.ttl
+            if feed.stale_while_revalidate is None:
+                feed.stale_while_revalidate = self.stale_while_revalidate
+            if feed.stale_if_error is None:
+                feed.stale_if_error = self.stale_if_error
+            feed.history_items = feed.history_items or self.history_items
+            feed.history_days = feed.history_days or self.history_days
+            feed.max_items = feed.max_items or self.max_items
+            feed.formats = feed.formats or self.formats
+
+        return self
 
-    @staticmethod
-    def _resolve_path(base: Path, rel: Path) -> Path:
-        ret = rel.expanduser()
-        if not ret.is_absolute():
-            ret = base.parent / ret
+    @pydantic.model_validator(mode="after")
+    def check_shared_cache(self) -> Config:
+        # Workers sharing cache_dir usually do it over a network filesystem,
+        # where SQLite locking (and WAL mode) can't be relied on
+        if not self.lease_duration:
+            return self
+
+        if self.cache_backend == "sqlite":
+            raise ValueError("lease_duration can't be used with cache_backend: sqlite")
+
+        if (
+            self.history_items
+            or self.history_days
+            or any(feed.history_items or feed.history_days for feed in self.feeds)
+        ):
+            raise ValueError(
+                "lease_duration can't be used with history_items or history_days"
+            )
 
-        return ret
+        return self
 
     @classmethod
-    def from_filepath(cls, filepath: Path):
-        with filepath.open("rt") as fh:
-            data = yaml.load(fh, Loader=YAML_LOADER)
-            self = Config(**data)
+    def from_filepath(cls, filepath: Path, snapshot_dir: Path | None = None):
+        """
+        Load the config file at `filepath`, along with the feeds in its
+        `include` directory. See `snapshot.load_config`.
+        """
+        from .snapshot import load_config
 
-        self.output_dir = cls._resolve_path(filepath, self.output_dir)
-        self.cache_dir = cls._resolve_path(filepath, self.cache_dir)
+        return load_config(filepath, snapshot_dir)
 
-        return self
+    @property
+    def history_path(self) -> Path:
+        return self.cache_dir / "entries.sqlite"
 
 
 class FeedInfo(pydantic.BaseModel):
@@ -85,6 +154,17 @@ class Feed(FeedInfo):
     model_config = pydantic.ConfigDict(extra="forbid")
 
     queries: Queries
+    backend: BackendName | None = None
+    partial_parse: bool | None = None
+    low_memory: bool | None = None
+    max_input_bytes: pydantic.PositiveInt | None = None
+    ttl: pydantic.PositiveInt | None = None
+    stale_while_revalidate: pydantic.NonNegativeInt | None = None
+    stale_if_error: pydantic.NonNegativeInt | None = None
+    history_items: pydantic.PositiveInt | None = None
+    history_days: pydantic.PositiveInt | None = None
+    max_items: pydantic.PositiveInt | None = None
+    formats: list[OutputFormat] | None = None
 
     @pydantic.model_validator(mode="before")
     @classmethod
@@ -0,0 +1,153 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from __future__ import annotations
+
+import gzip
+import logging
+import os
+import re
+import tempfile
+from collections.abc import Iterable
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal
+
+if TYPE_CHECKING:
+    from .models import Feed, OutputFormat
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LOGGER = logging.getLogger(__name__)
+
+Compression = Literal["gzip", "br"]
+
+SUFFIXES: dict[Compression, str] = {"gzip": ".gz", "br": ".br"}
+
+OUTPUT_SUFFIXES: dict[OutputFormat, str] = {
+    "rss": ".rss",
+    "atom": ".atom",
+    "json": ".json",
+}
+
+# Fields that change on every build, without the document changing at all
+_VOLATILE = re.compile(rb"<(lastBuildDate|updated)>[^<]*</\1>")
+
+
+def slufigy(s: str) -> str:
+    s_ = re.sub(r"[^a-z0-9]", "", s, flags=re.IGNORECASE).lower()
+    if not s_:
+        raise ValueError(s)
+
+    return s_
+
+
+def output_paths(output_dir: Path, feed: Feed) -> dict[OutputFormat, Path]:
+    slug = slufigy(feed.name or "")
+    return {
+        format: output_dir / f"{slug}{OUTPUT_SUFFIXES[format]}"
+        for format in feed.formats or ["rss"]
+    }
+
+
+class OutputWriter:
+    """
+    Write output files atomically and only if their content changed.
+
+    Documents are compared with the existing file ignoring volatile fields
+    (`lastBuildDate`, Atom's `updated`), so unchanged feeds keep their mtime
+    and readers relying on it don't download them again. Optionally writes
+    precompressed siblings (`.gz`, `.br`) for static servers, removing those
+    of disabled compressions.
+    """
+
+    def __init__(self, precompress: Iterable[Compression] = ()):
+        self.precompress = list(precompress)
+        if "br" in self.precompress and brotli is None:
+            LOGGER.warning("brotli module not available, '.br' files disabled")
+            self.precompress.remove("br")
+
+    def write(self, filepath: Path, contents: bytes) -> bool:
+        """
+        Write `contents` into `filepath` if it changed, returns True if it
+        was written
+        """
+        try:
+            current = filepath.read_bytes()
+        except FileNotFoundError:
+            current = None
+
+        if current is not None and _stable(current) == _stable(contents):
+            # Keep the existing document, siblings may be missing still
+            self._write_siblings(filepath, current, only_missing=True)
+            return False
+
+        self._write_siblings(filepath, contents)
+        write_atomic(filepath, contents)
+
+        return True
+
+    def _write_siblings(
+        self, filepath: Path, contents: bytes, only_missing: bool = False
+    ) -> None:
+        for compression, suffix in SUFFIXES.items():
+            sibling = filepath.with_name(filepath.name + suffix)
+            if compression not in self.precompress:
+                # Left by previous settings, static servers would keep
+                # serving its outdated contents
+                sibling.unlink(missing_ok=True)
+                continue
+
+            if only_missing and sibling.exists():
+                continue
+
+            write_atomic(sibling, compress(contents, compression))
+
+
+def compress(contents: bytes, compression: Compression) -> bytes:
+    if compression == "gzip":
+        # No timestamp, the same document always gives the same bytes
+        return gzip.compress(contents, compresslevel=9, mtime=0)
+
+    if compression == "br":
+        return brotli.compress(contents, quality=11)
+
+    raise ValueError(compression)
+
+
+def write_atomic(filepath: Path, contents: bytes, mode: int = 0o644) -> None:
+    """
+    Write `filepath` through a temporary file renamed into place, so readers
+    see either the old or the new contents
+    """
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=filepath.parent, prefix=f".{filepath.name}.")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(contents)
+        os.chmod(tmp, mode)
+        os.replace(tmp, filepath)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _stable(contents: bytes) -> bytes:
+    return _VOLATILE.sub(b"", contents)
@@ -15,14 +15,16 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
+from collections.abc import Callable, Iterator
 from dataclasses import dataclass, field
+from typing import Any
 
-import bs4
+from .backends import DEFAULT_BACKEND, BackendName, get_backend
+from .models import Queries
+from .query import Query, QueryPlan, get, get_one
 
-from .query import Query, get, get_one
 
-
-@dataclass
+@dataclass(slots=True)
 class ParsedEntry:
     link: str
     title: str | None = None
@@ -31,7 +33,7 @@ class ParsedEntry:
     date: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ParsedBuffer:
     link: str = ""
     title: str | None = None
@@ -48,6 +50,9 @@ class Parser:
         content: Query | str | None,
         date: Query | str | None,
         image: Query | str | None,
+        backend: BackendName = DEFAULT_BACKEND,
+        partial: bool = False,
+        low_memory: bool = False,
     ) -> None:
         self.entries = entries
         self.link = link
@@ -55,38 +60,99 @@ class Parser:
         self.content = content
         self.date = date
         self.image = image
+        self.backend = get_backend(backend)
+        self.partial = partial
+        self.low_memory = low_memory
+        self.plan = QueryPlan.build(
+            self.backend,
+            entries=entries,
+            link=link,
+            title=title,
+            content=content,
+            date=date,
+            image=image,
+        )
+
+    @classmethod
+    def from_queries(
+        cls,
+        queries: Queries,
+        backend: BackendName = DEFAULT_BACKEND,
+        partial: bool = False,
+        low_memory: bool = False,
+    ) -> "Parser":
+        return cls(
+            entries=queries.entries,
+            link=queries.link,
+            title=queries.title,
+            content=queries.content,
+            date=queries.date,
+            image=queries.image,
+            backend=backend,
+            partial=partial,
+            low_memory=low_memory,
+        )
 
     def parse(self, buff: bytes) -> ParsedBuffer:
-        def parse_entry(tag: bs4.Tag):
-            if (link_ := get_one(tag, self.link)) is None:
+        data, entries = self.stream(buff)
+        data.entries = list(entries)
+
+        return data
+
+    def stream(self, buff: bytes) -> tuple[ParsedBuffer, Iterator[ParsedEntry]]:
+        """
+        Parse the document and its feed fields, entries are extracted lazily
+        as the returned iterator is consumed (`entries` of the returned
+        buffer is left empty).
+        """
+        backend = self.backend
+        plan = self.plan
+
+        def parse_entry(tag: Any):
+            if (link_ := get_one(tag, plan.link, backend)) is None:
                 raise ValueError(tag)
 
-            if self.content:
-                content = "\n".join([x or "" for x in get(tag, self.content)])
+            if plan.content:
+                content = "\n".join([x or "" for x in get(tag, plan.content, backend)])
             else:
                 content = None
 
             return ParsedEntry(
                 link=link_,
-                title=get_one(tag, self.title) if self.title else None,
+                title=get_one(tag, plan.title, backend) if plan.title else None,
                 content=content,
-                image=get_one(tag, self.image) if self.image else None,
-                date=get_one(tag, self.date) if self.date else None,
+                image=get_one(tag, plan.image, backend) if plan.image else None,
+                date=get_one(tag, plan.date, backend) if plan.date else None,
             )
 
-        soup = bs4.BeautifulSoup(buff, features="html.parser")
+        # Restricted parses keep only <head> and the regions containing
+        # entries, when the entries selector allows it
+        soup = backend.parse(buff, regions=plan.regions if self.partial else None)
 
-        link_q = Query(
-            selector="head link", attributes={"rel": "canonical"}, target="href"
-        )
-        feed_link = get_one(soup, link_q) or ""
+        feed_link = get_one(soup, plan.feed_link, backend) or ""
 
-        feed_title = (get_one(soup, "head title") or "").strip()
+        feed_title = (get_one(soup, plan.feed_title, backend) or "").strip()
 
-        ret = ParsedBuffer(
-            link=feed_link,
-            title=feed_title,
-            entries=[parse_entry(x) for x in soup.select(self.entries)],
-        )
+        ret = ParsedBuffer(link=feed_link, title=feed_title)
+        if self.low_memory:
+            entries = self._release_as_parsed(
+                backend.select(soup, plan.entries.pattern), parse_entry
+            )
+        else:
+            entries = (
+                parse_entry(x) for x in backend.iselect(soup, plan.entries.pattern)
+            )
 
-        return ret
+        return ret, entries
+
+    def _release_as_parsed(
+        self, nodes: list[Any], parse_entry: Callable[[Any], ParsedEntry]
+    ) -> Iterator[ParsedEntry]:
+        # Matches are collected first, the tree can't be modified while it's
+        # being walked. Each entry subtree is freed once extracted, so the
+        # document shrinks as entries are consumed.
+        for idx, node in enumerate(nodes):
+            entry = parse_entry(node)
+            nodes[idx] = None
+            self.backend.release(node)
+            yield entry
@@ -0,0 +1,279 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import contextlib
+import io
+import itertools
+import logging
+import time
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from pathlib import Path
+
+from .backends import DEFAULT_BACKEND
+from .builder import Builder
+from .fixers import ALL as ALL_FIXERS
+from .fixers import fix_stream
+from .history import EntryStore
+from .metrics import NULL_METRICS, Metrics
+from .models import Feed, OutputFormat
+from .parser import ParsedEntry, Parser
+
+LOGGER = logging.getLogger(__name__)
+
+
+def parser_for(feed: Feed) -> Parser:
+    return Parser.from_queries(
+        feed.queries,
+        backend=feed.backend or DEFAULT_BACKEND,
+        partial=bool(feed.partial_parse),
+        low_memory=bool(feed.low_memory),
+    )
+
+
+def build(
+    feed: Feed,
+    buff: bytes,
+    pretty: bool = True,
+    parser: Parser | None = None,
+    history: Path | None = None,
+    metrics: Metrics = NULL_METRICS,
+    format: OutputFormat = "rss",
+) -> bytes:
+    """
+    Parse, fix and build a single feed in one `format`, see `build_formats`
+    """
+    return build_formats(
+        feed, buff, pretty, parser, history, metrics, formats=[format]
+    )[format]
+
+
+def build_formats(
+    feed: Feed,
+    buff: bytes,
+    pretty: bool = True,
+    parser: Parser | None = None,
+    history: Path | None = None,
+    metrics: Metrics = NULL_METRICS,
+    formats: Iterable[OutputFormat] | None = None,
+) -> dict[OutputFormat, bytes]:
+    """
+    Parse, fix and build a single feed in each of `formats` (the feed's
+    formats by default), all of them from the same parse.
+
+    This is the unit of work sent to worker processes so it must stay a
+    module-level function and only take/return picklable values. Long-lived
+    callers can pass a `parser` they keep around.
+
+    If `history` (an `EntryStore` database) is given and the feed keeps
+    history, parsed entries are merged into it and the feed is built from
+    its window of recent entries instead.
+
+    Entries are streamed: each one is extracted and fixed right before the
+    builder takes it, and extraction stops after the feed's `max_items`.
+    The builder collects them (the document is kept until then) to write
+    them in reverse document order.
+    Pages larger than the feed's `max_input_bytes` are truncated (HTML
+    parsers cope with it, entries at the top are kept).
+    """
+    if feed.max_input_bytes and len(buff) > feed.max_input_bytes:
+        LOGGER.warning(
+            f"{feed.name}: input truncated to {feed.max_input_bytes} bytes"
+            f" ({len(buff)} bytes)"
+        )
+        buff = buff[: feed.max_input_bytes]
+
+    # Entries are extracted and fixed lazily, while later stages consume
+    # them, each stage is timed on its own
+    clock = _StageClock(metrics, feed.name)
+    with metrics.memory(feed.name):
+        with clock.timer("parse"):
+            data, entries = (parser or parser_for(feed)).stream(buff)
+
+        with clock.timer("fix"):
+            stream = fix_stream(
+                [x(feed) for x in ALL_FIXERS], data, clock.timed("parse", entries)
+            )
+        stream = clock.timed("fix", stream)
+        if feed.max_items:
+            stream = itertools.islice(stream, feed.max_items)
+        if metrics.enabled:
+            stream = _counted(stream, metrics, feed.name)
+
+        if history and (feed.history_items or feed.history_days):
+            with clock.timer("history"), EntryStore(history) as store:
+                store.merge(feed.name, list(stream))
+                stream = iter(
+                    store.window(
+                        feed.name,
+                        max_items=feed.history_items,
+                        max_age=feed.history_days * 86400
+                        if feed.history_days
+                        else None,
+                    )
+                )
+
+        # Serialized straight to bytes, ready to be written to disk
+        with clock.timer("build"):
+            outputs = {x: io.BytesIO() for x in formats or feed.formats or ["rss"]}
+            Builder().write_formats(data, outputs, pretty=pretty, entries=stream)
+
+    return {format: fh.getvalue() for format, fh in outputs.items()}
+
+
+class _StageClock:
+    """
+    Per-stage timings of a feed whose stages run interleaved, as streamed
+    entries are pulled through them. Each stage only counts its own work:
+    time spent in nested timers (ie. extracting the entries a stage
+    consumes) is left to their stages.
+    """
+
+    def __init__(self, metrics: Metrics, feed: str):
+        self.metrics = metrics
+        self.feed = feed
+        # Time already added to some stage
+        self._counted = 0.0
+
+    @contextlib.contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        start, counted = time.perf_counter(), self._counted
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start - (self._counted - counted)
+            self._counted += elapsed
+            self.metrics.add("stage_seconds", elapsed, feed=self.feed, stage=stage)
+
+    def timed(
+        self, stage: str, entries: Iterable[ParsedEntry]
+    ) -> Iterator[ParsedEntry]:
+        """
+        Time getting each of `entries` as `stage`
+        """
+        if not self.metrics.enabled:
+            return iter(entries)
+
+        return self._timed(stage, iter(entries))
+
+    def _timed(
+        self, stage: str, entries: Iterator[ParsedEntry]
+    ) -> Iterator[ParsedEntry]:
+        while True:
+            with self.timer(stage):
+                entry = next(entries, None)
+            if entry is None:
+                return
+
+            yield entry
+
+
+def _counted(
+    entries: Iterable[ParsedEntry], metrics: Metrics, name: str
+) -> Iterator[ParsedEntry]:
+    for entry in entries:
+        metrics.add("entries", feed=name)
+        yield entry
+
+
+def _build_measured(
+    feed: Feed, buff: bytes, pretty: bool, history: Path | None, trace_memory: bool
+) -> tuple[dict[OutputFormat, bytes], dict]:
+    # Worker processes can't share the parent's metrics, they return theirs
+    metrics = Metrics(trace_memory=trace_memory)
+    outputs = build_formats(feed, buff, pretty, history=history, metrics=metrics)
+
+    return outputs, metrics.values
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool for `build_all`. Workers are not forked from the caller,
+    which usually has fetch threads running (forking a multi-threaded
+    process can leave locks held in the children).
+    """
+    method = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers, mp_context=get_context(method))
+
+
+def build_all(
+    jobs: Iterable[tuple[Feed, bytes]],
+    workers: int = 1,
+    pretty: bool = True,
+    history: Path | None = None,
+    metrics: Metrics = NULL_METRICS,
+    on_error: Callable[[Feed, Exception], None] | None = None,
+    executor: Executor | None = None,
+) -> Iterator[tuple[Feed, dict[OutputFormat, bytes]]]:
+    """
+    Build every (feed, buffer) pair, yielding results in the input order.
+
+    Jobs are sent to `executor` if given, or to a pool of `workers`
+    processes if that's > 1 (see `process_pool`). Callers building several
+    batches should keep their own pool. Errors raised while building a feed
+    are re-raised when its result is reached, unless `on_error` is given:
+    it's called instead and the feed is skipped.
+    """
+
+    def failed(feed: Feed, e: Exception) -> None:
+        if on_error is None:
+            raise e
+
+        metrics.add("errors", feed=feed.name, stage="build")
+        on_error(feed, e)
+
+    if executor is None and workers <= 1:
+        for feed, buff in jobs:
+            try:
+                outputs = build_formats(
+                    feed, buff, pretty, history=history, metrics=metrics
+                )
+            except Exception as e:
+                failed(feed, e)
+                continue
+
+            yield feed, outputs
+
+        return
+
+    if executor is None:
+        with process_pool(workers) as executor:
+            yield from build_all(
+                jobs, workers, pretty, history, metrics, on_error, executor
+            )
+        return
+
+    futures = [
+        (
+            feed,
+            executor.submit(
+                _build_measured, feed, buff, pretty, history, metrics.trace_memory
+            ),
+        )
+        for feed, buff in jobs
+    ]
+    for feed, fut in futures:
+        try:
+            outputs, values = fut.result()
+        except Exception as e:
+            failed(feed, e)
+            continue
+
+        metrics.merge(values)
+        yield feed, outputs
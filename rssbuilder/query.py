@@ -16,13 +16,135 @@
 # USA.
 
 
-import bs4
+import functools
+from dataclasses import dataclass
+from typing import Any
+
+from .backends import Backend, BackendName, get_backend
+from .models import Queries, Query
+from .strainer import Region, regions_for
+
+
+@dataclass(frozen=True)
+class CompiledQuery:
+    backend: BackendName
+    pattern: Any
+    attributes: dict[str, str] | None = None
+    target: str | None = None
+
+
+@dataclass(frozen=True)
+class QueryPlan:
+    """
+    Compiled form of a feed's `Queries` plus the feed-level lookups done by
+    `Parser`
+    """
+
+    entries: CompiledQuery
+    link: CompiledQuery
+    title: CompiledQuery | None
+    content: CompiledQuery | None
+    date: CompiledQuery | None
+    image: CompiledQuery | None
+    feed_link: CompiledQuery
+    feed_title: CompiledQuery
+    regions: list[Region] | None = None
+
+    @classmethod
+    def from_queries(cls, queries: Queries, backend: Backend) -> "QueryPlan":
+        return cls.build(
+            backend,
+            entries=queries.entries,
+            link=queries.link,
+            title=queries.title,
+            content=queries.content,
+            date=queries.date,
+            image=queries.image,
+        )
+
+    @classmethod
+    def build(
+        cls,
+        backend: Backend,
+        *,
+        entries: Query | str,
+        link: Query | str,
+        title: Query | str | None = None,
+        content: Query | str | None = None,
+        date: Query | str | None = None,
+        image: Query | str | None = None,
+    ) -> "QueryPlan":
+        def compile_opt(query: Query | str | None) -> CompiledQuery | None:
+            return compile_query(query, backend) if query else None
+
+        return cls(
+            entries=compile_query(entries, backend),
+            link=compile_query(link, backend),
+            title=compile_opt(title),
+            content=compile_opt(content),
+            date=compile_opt(date),
+            image=compile_opt(image),
+            feed_link=compile_query(FEED_LINK_QUERY, backend),
+            feed_title=compile_query(FEED_TITLE_QUERY, backend),
+            regions=regions_for(
+                entries if isinstance(entries, str) else entries.selector
+            ),
+        )
+
+
+FEED_LINK_QUERY = Query(
+    selector="head link", attributes={"rel": "canonical"}, target="href"
+)
+FEED_TITLE_QUERY = Query(selector="head title")
+
+
+def compile_query(
+    query: Query | CompiledQuery | str, backend: Backend | None = None
+) -> CompiledQuery:
+    backend = backend or get_backend()
+
+    if isinstance(query, CompiledQuery):
+        if query.backend != backend.name:
+            raise ValueError("Query compiled for another backend", query)
+        return query
 
-from .models import Query
-
-
-def get_one(soup: bs4.Tag, query: Query | str) -> str | None:
-    if results := get(soup, query):
+    if isinstance(query, str):
+        return _compile(backend, query, None, None)
+
+    if isinstance(query, Query):
+        attributes = (
+            tuple((str(k), str(v)) for k, v in query.attributes.items())
+            if query.attributes
+            else None
+        )
+        return _compile(backend, query.selector, attributes, query.target)
+
+    raise TypeError(query)
+
+
+# Compiled queries are shared by every feed (and every run in long-lived
+# processes) using the same backend and selector
+@functools.lru_cache(maxsize=4096)
+def _compile(
+    backend: Backend,
+    selector: str,
+    attributes: tuple[tuple[str, str], ...] | None,
+    target: str | None,
+) -> CompiledQuery:
+    return CompiledQuery(
+        backend=backend.name,
+        pattern=backend.compile(selector),
+        attributes=dict(attributes) if attributes else None,
+        target=target,
+    )
+
+
+def get_one(
+    soup: Any,
+    query: Query | CompiledQuery | str,
+    backend: Backend | None = None,
+) -> str | None:
+    if results := get(soup, query, backend):
         return results[0]
 
     if len(results) > 1:
@@ -31,28 +153,31 @@ def get_one(soup: bs4.Tag, query: Query | str) -> str | None:
     return None
 
 
-def get(soup: bs4.Tag, query: Query | str) -> list[str | None]:
-    if isinstance(query, str):
-        query = Query(selector=query)
-    elif isinstance(query, Query):
-        pass
-    else:
-        raise TypeError(query)
+def get(
+    soup: Any,
+    query: Query | CompiledQuery | str,
+    backend: Backend | None = None,
+) -> list[str | None]:
+    backend = backend or get_backend()
+    query = compile_query(query, backend)
 
-    tags = soup.select(query.selector)
+    tags = backend.select(soup, query.pattern)
 
     if query.attributes:
-        tags = [tag for tag in tags if matches_attrs(tag, query.attributes)]
+        tags = [tag for tag in tags if matches_attrs(tag, query.attributes, backend)]
 
     if query.target:
-        return [tag.attrs.get(query.target) for tag in tags]
+        return [backend.attrs(tag).get(query.target) for tag in tags]
     else:
-        return [tag.text for tag in tags]
+        return [backend.text(tag) for tag in tags]
+
 
+def matches_attrs(tag: Any, attrs: dict[str, str], backend: Backend | None = None):
+    backend = backend or get_backend()
+    tag_attrs = backend.attrs(tag)
 
-def matches_attrs(tag: bs4.Tag, attrs: dict[str, str]):
     for name, value in attrs.items():
-        tag_values = tag.attrs.get(name)
+        tag_values = tag_attrs.get(name)
 
         if not tag_values:
             return False
@@ -0,0 +1,245 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import functools
+import gzip
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .breaker import CircuitBreaker
+from .cache import Cache
+from .fetcher import Fetcher, FetchPool, Response
+from .models import Config, Feed
+from .output import slufigy
+from .parser import Parser
+from .pipeline import build, parser_for
+from .sources import complete_refresh, resolve_buffers
+
+LOGGER = logging.getLogger(__name__)
+
+CONTENT_TYPE = "application/rss+xml; charset=utf-8"
+
+
+@dataclass
+class Rendered:
+    body: bytes
+    gzipped: bytes
+    etag: str
+    last_modified: float
+    source_hash: str
+    built_at: float
+
+    @property
+    def gzip_etag(self) -> str:
+        return self.etag[:-1] + '-gzip"'
+
+
+class FeedCache:
+    """
+    In-memory copy of every feed, ready to be served. Feeds are (re)built
+    on demand when requested after their TTL expired.
+    """
+
+    def __init__(self, config: Config, fetcher: Fetcher | None = None):
+        self.config = config
+        self.cache = Cache.from_config(config)
+        # Background revalidations outlive the request that started them, the
+        # pool is kept until the cache is closed
+        self.pool = FetchPool.from_config(config, fetcher)
+        self.breaker = CircuitBreaker(
+            config.cache_dir / "circuits.json", threshold=config.breaker_threshold
+        )
+        self.breaker.load()
+
+        self.feeds: dict[str, Feed] = {}
+        for feed in config.feeds:
+            try:
+                self.feeds[slufigy(feed.name or "")] = feed
+            except ValueError:
+                LOGGER.error(f"feed name can't be used in URLs, skipped: {feed.name}")
+        self.parsers: dict[str, Parser] = {
+            slug: parser_for(feed) for slug, feed in self.feeds.items()
+        }
+        self.rendered: dict[str, Rendered] = {}
+        self._locks = {slug: threading.Lock() for slug in self.feeds}
+
+    def close(self) -> None:
+        self.pool.close()
+        self.breaker.save()
+
+    def get(self, slug: str) -> Rendered | None:
+        if slug not in self.feeds:
+            return None
+
+        feed = self.feeds[slug]
+        rendered = self.rendered.get(slug)
+        if rendered and time.monotonic() - rendered.built_at < feed.ttl:
+            return rendered
+
+        # Only one thread refreshes each feed, concurrent requests wait for
+        # it and get its result
+        with self._locks[slug]:
+            current = self.rendered.get(slug)
+            if current is not rendered:
+                return current
+
+            try:
+                self.rendered[slug] = self._render(slug, rendered)
+            except Exception as e:
+                if rendered is None:
+                    raise
+
+                LOGGER.warning(
+                    f"unable to refresh {feed.name}, serving old copy: {e!r}"
+                )
+                rendered.built_at = time.monotonic()
+
+        return self.rendered[slug]
+
+    def _render(self, slug: str, previous: Rendered | None) -> Rendered:
+        feed = self.feeds[slug]
+
+        buffers, refreshes, errors = resolve_buffers(
+            [feed], self.cache, self.pool, breaker=self.breaker
+        )
+        for url, fut in refreshes.items():
+            fut.add_done_callback(functools.partial(self._refreshed, url, buffers))
+        self.breaker.save()
+
+        if feed.url in errors:
+            raise errors[feed.url]
+
+        buff = buffers[feed.url]
+        source_hash = hashlib.sha256(buff).hexdigest()
+        if previous and previous.source_hash == source_hash:
+            previous.built_at = time.monotonic()
+            return previous
+
+        body = build(
+            feed,
+            buff,
+            pretty=not self.config.compact_output,
+            parser=self.parsers[slug],
+            history=self.config.history_path,
+        )
+        LOGGER.info(f"built {feed.name}")
+
+        return Rendered(
+            body=body,
+            gzipped=gzip.compress(body, mtime=0),
+            etag='"' + hashlib.sha256(body).hexdigest()[:32] + '"',
+            last_modified=time.time(),
+            source_hash=source_hash,
+            built_at=time.monotonic(),
+        )
+
+    def _refreshed(
+        self, url: str, buffers: dict[str, bytes], fut: Future[Response]
+    ) -> None:
+        complete_refresh(self.cache, url, fut, buffers, self.breaker)
+
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    server: "FeedServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+    def do_HEAD(self):
+        self.handle_feed(send_body=False)
+
+    def do_GET(self):
+        self.handle_feed(send_body=True)
+
+    def handle_feed(self, send_body: bool) -> None:
+        slug = self.path.split("?", 1)[0].strip("/").removesuffix(".rss")
+
+        try:
+            rendered = self.server.feeds.get(slug)
+        except Exception as e:
+            LOGGER.error(f"unable to build {slug}: {e!r}")
+            self.send_error(HTTPStatus.BAD_GATEWAY)
+            return
+
+        if rendered is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        etag = rendered.gzip_etag if use_gzip else rendered.etag
+        body = rendered.gzipped if use_gzip else rendered.body
+
+        if self.is_not_modified(rendered):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_feed_headers(rendered, etag)
+            self.end_headers()
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_feed_headers(rendered, etag)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+
+        if send_body:
+            self.wfile.write(body)
+
+    def send_feed_headers(self, rendered: Rendered, etag: str) -> None:
+        self.send_header("ETag", etag)
+        self.send_header(
+            "Last-Modified", formatdate(rendered.last_modified, usegmt=True)
+        )
+        self.send_header("Vary", "Accept-Encoding")
+
+    def is_not_modified(self, rendered: Rendered) -> bool:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        if if_none_match := self.headers.get("If-None-Match"):
+            tags = {x.strip().removeprefix("W/") for x in if_none_match.split(",")}
+            return bool(tags & {rendered.etag, rendered.gzip_etag, "*"})
+
+        if if_modified_since := self.headers.get("If-Modified-Since"):
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+
+            return int(rendered.last_modified) <= since
+
+        return False
+
+
+class FeedServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], feeds: FeedCache):
+        super().__init__(address, FeedRequestHandler)
+        self.feeds = feeds
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.feeds.close()
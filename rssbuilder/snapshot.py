@@ -0,0 +1,207 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import functools
+import hashlib
+import logging
+import pickle
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import pydantic
+import yaml
+
+from . import models
+from .consts import VERSION
+from .models import YAML_LOADER, Config, Feed, user_cache_path
+from .output import write_atomic
+
+LOGGER = logging.getLogger(__name__)
+
+INCLUDE_SUFFIXES = {".yaml", ".yml"}
+
+
+@dataclass
+class Snapshot:
+    """
+    A validated config, keyed by the hash of its YAML and rssbuilder's version
+    """
+
+    version: str
+    digest: str
+    config: Config
+    # Included file name -> (digest, feeds)
+    includes: dict[str, tuple[str, list[Feed]]] = field(default_factory=dict)
+
+
+def load_config(filepath: Path, snapshot_dir: Path | None = None) -> Config:
+    """
+    Load the config at `filepath`, from its snapshot if the file didn't
+    change. Snapshots are kept in `snapshot_dir` (a directory in the user
+    cache by default).
+
+    Feeds from the `include` directory are tracked per file, editing one of
+    them only revalidates that file.
+    """
+    filepath = filepath.absolute()
+    snapshot_dir = snapshot_dir or user_cache_path() / "config-snapshots"
+    snapshot_path = snapshot_dir / (
+        hashlib.sha256(str(filepath).encode("utf-8")).hexdigest() + ".pickle"
+    )
+
+    raw = filepath.read_bytes()
+    digest = _digest(raw)
+
+    snapshot = _read_snapshot(snapshot_path)
+    if snapshot is None or snapshot.digest != digest:
+        LOGGER.debug(f"validating {filepath}")
+        snapshot = Snapshot(
+            version=_version(), digest=digest, config=_validate_config(filepath, raw)
+        )
+        dirty = True
+    else:
+        dirty = False
+
+    base = snapshot.config
+    includes: dict[str, tuple[str, list[Feed]]] = {}
+    if base.include:
+        if base.include.is_dir():
+            paths = sorted(base.include.iterdir())
+        else:
+            # The directory may be created later, the daemon reloads then
+            LOGGER.warning(f"include directory {base.include} not found, ignoring")
+            paths = []
+
+        for path in paths:
+            if path.suffix not in INCLUDE_SUFFIXES or not path.is_file():
+                continue
+
+            raw = path.read_bytes()
+            digest = _digest(raw)
+            if prev := snapshot.includes.get(path.name):
+                if prev[0] == digest:
+                    includes[path.name] = prev
+                    continue
+
+            LOGGER.debug(f"validating {path}")
+            includes[path.name] = (digest, _validate_feeds(path, raw))
+            dirty = True
+
+        dirty = dirty or includes.keys() != snapshot.includes.keys()
+
+    # The merged config is validated again, so config defaults are filled
+    # into included feeds too and config-wide checks cover them. Snapshots
+    # are only reused with the same base config so they can be stored filled
+    config = Config.model_validate(
+        {
+            **dict(base),
+            "feeds": [
+                *base.feeds,
+                *(feed for _, feeds in includes.values() for feed in feeds),
+            ],
+        }
+    )
+
+    if dirty:
+        snapshot.includes = includes
+        _write_snapshot(snapshot_path, snapshot)
+
+    return config
+
+
+def _digest(raw: bytes) -> str:
+    return hashlib.sha256(_version().encode("utf-8") + b"\0" + raw).hexdigest()
+
+
+@functools.cache
+def _version() -> str:
+    # Development versions don't change along with the models, their source
+    # is part of the key too
+    source = Path(models.__file__).read_bytes()
+
+    return f"{VERSION}+{hashlib.sha256(source).hexdigest()[:16]}"
+
+
+def _load_yaml(raw: bytes) -> Any:
+    return yaml.load(raw, Loader=YAML_LOADER)
+
+
+def _resolve_path(base: Path, rel: Path) -> Path:
+    ret = rel.expanduser()
+    if not ret.is_absolute():
+        ret = base.parent / ret
+
+    return ret
+
+
+def _validate_config(filepath: Path, raw: bytes) -> Config:
+    config = Config(**(_load_yaml(raw) or {}))
+
+    config.output_dir = _resolve_path(filepath, config.output_dir)
+    config.cache_dir = _resolve_path(filepath, config.cache_dir)
+    if config.include:
+        config.include = _resolve_path(filepath, config.include)
+
+    return config
+
+
+def _validate_feeds(filepath: Path, raw: bytes) -> list[Feed]:
+    """
+    Included files hold one feed, or a list of them
+    """
+    data = _load_yaml(raw)
+    if data is None:
+        return []
+
+    try:
+        return pydantic.TypeAdapter(list[Feed]).validate_python(
+            data if isinstance(data, list) else [data]
+        )
+    except pydantic.ValidationError:
+        LOGGER.error(f"invalid feed in {filepath}")
+        raise
+
+
+def _read_snapshot(filepath: Path) -> Snapshot | None:
+    try:
+        with filepath.open("rb") as fh:
+            snapshot = pickle.load(fh)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        LOGGER.debug(f"unable to read config snapshot {filepath}: {e!r}")
+        return None
+
+    if not isinstance(snapshot, Snapshot) or snapshot.version != _version():
+        return None
+
+    return snapshot
+
+
+def _write_snapshot(filepath: Path, snapshot: Snapshot) -> None:
+    try:
+        write_atomic(
+            filepath,
+            pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL),
+            mode=0o600,
+        )
+
+    except OSError as e:
+        # Snapshots are an optimization, failing to save one is not an error
+        LOGGER.debug(f"unable to save config snapshot {filepath}: {e!r}")
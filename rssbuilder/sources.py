@@ -0,0 +1,178 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from __future__ import annotations
+
+import logging
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+
+from .metrics import NULL_METRICS, Metrics
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from .breaker import CircuitBreaker
+    from .cache import Cache
+    from .fetcher import FetchPool, Response
+    from .models import Feed
+
+LOGGER = logging.getLogger(__name__)
+
+
+def store_response(
+    cache: Cache, url: str, resp: Response, buffers: dict[str, bytes]
+) -> None:
+    if resp.not_modified and url in buffers:
+        cache.touch(url)
+    else:
+        cache.set(url, resp.body, resp.validators)
+        buffers[url] = resp.body
+
+
+def is_host_failure(e: Exception) -> bool:
+    """
+    Whether `e` means the host is failing (so it counts for its circuit
+    breaker), as opposed to client errors like a 404
+    """
+    from .fetcher import HTTPStatusError
+
+    return not (isinstance(e, HTTPStatusError) and e.status < 500)
+
+
+def resolve_buffers(
+    feeds: Iterable[Feed],
+    cache: Cache,
+    pool: FetchPool,
+    metrics: Metrics = NULL_METRICS,
+    breaker: CircuitBreaker | None = None,
+) -> tuple[dict[str, bytes], dict[str, Future[Response]], dict[str, Exception]]:
+    """
+    Get buffers for every feed before parsing anything.
+
+    Fresh entries are read from cache. Entries within their
+    stale-while-revalidate window are used as they are while a refresh runs
+    in the background (returned futures, see `complete_refresh`). Everything
+    else is fetched concurrently, falling back to stale contents within the
+    stale-if-error window if that fails. Hosts with an open `breaker`
+    circuit are not requested, as if their fetch failed.
+
+    URLs without a buffer are returned along with their error.
+    """
+    from .breaker import CircuitOpenError
+    from .cache import MissError
+
+    buffers: dict[str, bytes] = {}
+    validators: dict[str, dict[str, str]] = {}
+    ages: dict[str, float] = {}
+    misses: dict[str, Future[Response]] = {}
+    refreshes: dict[str, Future[Response]] = {}
+    failures: dict[str, Exception] = {}
+
+    # The same page can be used by more than one feed, the first one wins
+    by_url: dict[str, Feed] = {}
+    for feed in feeds:
+        by_url.setdefault(feed.url, feed)
+
+    def failed(url: str, e: Exception) -> None:
+        feed = by_url[url]
+        if url in buffers and ages[url] < feed.ttl + feed.stale_if_error:
+            LOGGER.warning(f"fetch failed for {url}, using stale copy: {e}")
+            return
+
+        LOGGER.error(f"fetch failed for {url}: {e!r}")
+        buffers.pop(url, None)
+        failures[url] = e
+
+    for url, feed in by_url.items():
+        try:
+            ages[url] = cache.age(url)
+            buffers[url], validators[url] = cache.get_stale(url)
+        except MissError:
+            metrics.add("cache", result="miss")
+            stale = False
+        else:
+            if ages[url] < feed.ttl:
+                LOGGER.debug(f"cache hit: {url}")
+                metrics.add("cache", result="hit")
+                continue
+
+            stale = ages[url] < feed.ttl + feed.stale_while_revalidate
+            if stale:
+                LOGGER.debug(f"cache stale, revalidating in background: {url}")
+                metrics.add("cache", result="stale")
+            else:
+                # Expired entries are revalidated instead of downloaded again
+                LOGGER.debug(f"cache expired: {url}")
+                metrics.add("cache", result="expired")
+
+        if breaker and not breaker.allow(url):
+            metrics.add("errors", feed=feed.name, stage="circuit")
+            if not stale:
+                failed(url, CircuitOpenError(url, breaker.retry_at(url)))
+            continue
+
+        fut = pool.submit(url, validators.get(url))
+        if stale:
+            refreshes[url] = fut
+        else:
+            misses[url] = fut
+
+    for url, fut in misses.items():
+        feed = by_url[url]
+        try:
+            resp = fut.result()
+        except Exception as e:
+            metrics.add("errors", feed=feed.name, stage="fetch")
+            if breaker and is_host_failure(e):
+                breaker.failure(url)
+            failed(url, e)
+            continue
+
+        if breaker:
+            breaker.success(url)
+        metrics.add("stage_seconds", resp.elapsed, feed=feed.name, stage="fetch")
+        metrics.add("fetched_bytes", len(resp.body), feed=feed.name)
+        store_response(cache, url, resp, buffers)
+
+    return buffers, refreshes, failures
+
+
+def complete_refresh(
+    cache: Cache,
+    url: str,
+    fut: Future[Response],
+    buffers: dict[str, bytes],
+    breaker: CircuitBreaker | None = None,
+) -> None:
+    """
+    Store the result of a background revalidation started by
+    `resolve_buffers`, waiting for it if needed. Failures are only logged,
+    the stale copy was already used.
+    """
+    try:
+        resp = fut.result()
+    except Exception as e:
+        LOGGER.warning(f"background refresh failed for {url}: {e!r}")
+        if breaker and is_host_failure(e):
+            breaker.failure(url)
+        return
+
+    if breaker:
+        breaker.success(url)
+    store_response(cache, url, resp, buffers)
@@ -0,0 +1,122 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+import re
+from dataclasses import dataclass, field
+
+LOGGER = logging.getLogger(__name__)
+
+# Tags always kept by restricted parses: feed level data comes from there
+ALWAYS_KEPT = frozenset(["head"])
+
+_COMPOUND_RE = re.compile(
+    r"^(?P<name>[a-zA-Z][\w-]*|\*)?(?P<parts>(?:[.#][\w-]+|\[[^\]]+\])*)$"
+)
+_PART_RE = re.compile(
+    r"""([.#])([\w-]+)"""
+    r"""|\[\s*([\w-]+)\s*(?:=\s*(?:"([^"]*)"|'([^']*)'|([^\]\s]+))\s*)?\]"""
+)
+
+
+@dataclass(frozen=True)
+class Region:
+    """
+    Simple compound selector (tag, id, classes and attributes) identifying the
+    subtrees a restricted parse has to keep.
+    """
+
+    name: str | None = None
+    id: str | None = None
+    classes: frozenset[str] = field(default_factory=frozenset)
+    attrs: tuple[tuple[str, str | None], ...] = ()
+
+    def matches(self, name: str, attrs: dict[str, str | None]) -> bool:
+        if self.name and self.name != name.lower():
+            return False
+
+        if self.id and attrs.get("id") != self.id:
+            return False
+
+        if self.classes and not self.classes.issubset(
+            (attrs.get("class") or "").split()
+        ):
+            return False
+
+        for attr, value in self.attrs:
+            if attr not in attrs:
+                return False
+            if value is not None and (attrs[attr] or "") != value:
+                return False
+
+        return True
+
+
+def parse_compound(compound: str) -> Region | None:
+    if not (m := _COMPOUND_RE.match(compound)):
+        return None
+
+    name = m.group("name")
+    id_ = None
+    classes = set()
+    attrs = []
+
+    for part in _PART_RE.finditer(m.group("parts")):
+        prefix, ident, attr, *values = part.groups()
+        if prefix == ".":
+            classes.add(ident)
+        elif prefix == "#":
+            id_ = ident
+        else:
+            value = next((v for v in values if v is not None), None)
+            attrs.append((attr.lower(), value))
+
+    return Region(
+        name=name.lower() if name and name != "*" else None,
+        id=id_,
+        classes=frozenset(classes),
+        attrs=tuple(attrs),
+    )
+
+
+def regions_for(selector: str) -> list[Region] | None:
+    """
+    Compute which regions of a document must be kept so `selector` keeps
+    matching the same elements.
+
+    Only selector lists made of simple compounds joined by descendant or child
+    combinators are supported, their leftmost compound is the region to keep.
+    Anything else (siblings, pseudo-classes…) depends on the rest of the
+    document and returns None.
+    """
+    ret = []
+
+    for part in selector.split(","):
+        compounds = part.replace(">", " ").split()
+        if not compounds:
+            return None
+
+        if not all(parse_compound(x) for x in compounds):
+            LOGGER.debug(f"selector not supported for restricted parse: {selector}")
+            return None
+
+        region = parse_compound(compounds[0])
+        assert region is not None
+        ret.append(region)
+
+    return ret
@@ -0,0 +1,327 @@
+# Copyright (C) 2024- Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import abc
+import json
+import re
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import BinaryIO
+
+from .consts import NAME
+from .parser import ParsedBuffer, ParsedEntry
+
+RSS_DOCS = "http://www.rssboard.org/rss-specification"
+RSS_GENERATOR = "python-feedgen"
+
+JSON_FEED_VERSION = "https://jsonfeed.org/version/1.1"
+
+NS_ATOM = "http://www.w3.org/2005/Atom"
+NS_CONTENT = "http://purl.org/rss/1.0/modules/content/"
+
+# Characters not allowed in XML 1.0 documents
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+
+_TEXT_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", "\r": "&#13;"})
+_ATTR_ESCAPES = str.maketrans(
+    {
+        "&": "&amp;",
+        "<": "&lt;",
+        ">": "&gt;",
+        '"': "&quot;",
+        "\n": "&#10;",
+        "\r": "&#13;",
+        "\t": "&#9;",
+    }
+)
+
+
+def escape_text(s: str) -> str:
+    return _INVALID_XML_CHARS.sub("", s).translate(_TEXT_ESCAPES)
+
+
+def escape_attr(s: str) -> str:
+    return _INVALID_XML_CHARS.sub("", s).translate(_ATTR_ESCAPES)
+
+
+@dataclass(slots=True)
+class EscapedEntry:
+    """
+    Entry fields escaped for XML, computed once and shared by every writer
+    """
+
+    link: str
+    link_attr: str
+    title: str | None
+    content: str | None
+    image_attr: str | None
+
+    @classmethod
+    def from_entry(cls, entry: ParsedEntry) -> "EscapedEntry":
+        return cls(
+            link=escape_text(entry.link),
+            link_attr=escape_attr(entry.link),
+            title=escape_text(entry.title) if entry.title else None,
+            content=escape_text(entry.content) if entry.content else None,
+            image_attr=escape_attr(entry.image) if entry.image else None,
+        )
+
+
+class Writer(abc.ABC):
+    """
+    Serialize feeds straight into a binary stream, without building any
+    intermediate tree. Entries are written in the order they are iterated
+    and writers only keep one of them in memory at a time (`Builder` does
+    collect them first, to write them in reverse document order).
+
+    Subclasses implement `start`, `item` and `end`. `write_all` drives
+    several writers with a single pass over the entries.
+    """
+
+    def __init__(self, fh: BinaryIO, pretty: bool = True):
+        self.fh = fh
+        self.pretty = pretty
+
+    def _line(self, depth: int, s: str) -> str:
+        if self.pretty:
+            return "  " * depth + s + "\n"
+
+        return s
+
+    def _elem(self, depth: int, name: str, text: str) -> str:
+        return self._line(depth, f"<{name}>{escape_text(text)}</{name}>")
+
+    @abc.abstractmethod
+    def start(self, data: ParsedBuffer, build_date: datetime) -> None:
+        pass
+
+    @abc.abstractmethod
+    def item(self, entry: ParsedEntry, escaped: EscapedEntry) -> None:
+        pass
+
+    @abc.abstractmethod
+    def end(self) -> None:
+        pass
+
+    def write(
+        self,
+        data: ParsedBuffer,
+        entries: Iterable[ParsedEntry] | None = None,
+        build_date: datetime | None = None,
+    ) -> None:
+        write_all([self], data, entries, build_date)
+
+
+def write_all(
+    writers: Sequence[Writer],
+    data: ParsedBuffer,
+    entries: Iterable[ParsedEntry] | None = None,
+    build_date: datetime | None = None,
+) -> None:
+    """
+    Write `data` with every writer in `writers`. Entries (`data.entries`
+    unless given) are iterated and escaped once.
+    """
+    if not (data.title and data.link and data.description):
+        missing = [
+            name for name in ["title", "link", "description"] if not getattr(data, name)
+        ]
+        raise ValueError(f"Required fields not set ({', '.join(missing)})")
+
+    build_date = build_date or datetime.now(timezone.utc)
+    entries = data.entries if entries is None else entries
+
+    for writer in writers:
+        writer.start(data, build_date)
+
+    for entry in entries:
+        if not (entry.title or entry.content):
+            raise ValueError("Required fields not set", entry)
+
+        escaped = EscapedEntry.from_entry(entry)
+        for writer in writers:
+            writer.item(entry, escaped)
+
+    for writer in writers:
+        writer.end()
+
+
+class RSSWriter(Writer):
+    """
+    RSS 2.0 writer. Output matches what feedgen's `rss_str()` generates for
+    the same data.
+    """
+
+    def start(self, data: ParsedBuffer, build_date: datetime) -> None:
+        self.fh.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+        self.fh.write(
+            self._line(
+                0,
+                f'<rss xmlns:atom="{NS_ATOM}" xmlns:content="{NS_CONTENT}"'
+                ' version="2.0">',
+            ).encode("utf-8")
+        )
+        self.fh.write(
+            "".join(
+                [
+                    self._line(1, "<channel>"),
+                    self._elem(2, "title", data.title or ""),
+                    self._elem(2, "link", data.link),
+                    self._elem(2, "description", data.description or ""),
+                    self._elem(2, "docs", RSS_DOCS),
+                    self._elem(2, "generator", RSS_GENERATOR),
+                    self._elem(2, "lastBuildDate", format_datetime(build_date)),
+                ]
+            ).encode("utf-8")
+        )
+
+    def item(self, entry: ParsedEntry, escaped: EscapedEntry) -> None:
+        parts = [self._line(2, "<item>")]
+        if escaped.title:
+            parts.append(self._line(3, f"<title>{escaped.title}</title>"))
+        parts.append(self._line(3, f"<link>{escaped.link}</link>"))
+        if escaped.content:
+            parts.append(self._line(3, f"<description>{escaped.content}</description>"))
+        parts.append(self._line(3, f'<guid isPermaLink="false">{escaped.link}</guid>'))
+        if escaped.image_attr:
+            parts.append(
+                self._line(
+                    3,
+                    f'<enclosure url="{escaped.image_attr}" length="0" type="image"/>',
+                )
+            )
+        parts.append(self._line(2, "</item>"))
+
+        self.fh.write("".join(parts).encode("utf-8"))
+
+    def end(self) -> None:
+        self.fh.write(
+            (self._line(1, "</channel>") + self._line(0, "</rss>")).encode("utf-8")
+        )
+
+
+class AtomWriter(Writer):
+    """
+    Atom 1.0 writer. Entries have no dates of their own, the build date is
+    used as their `updated` value.
+    """
+
+    def start(self, data: ParsedBuffer, build_date: datetime) -> None:
+        self.updated = escape_text(build_date.isoformat())
+
+        self.fh.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+        self.fh.write(
+            "".join(
+                [
+                    self._line(0, f'<feed xmlns="{NS_ATOM}">'),
+                    self._elem(1, "id", data.link),
+                    self._elem(1, "title", data.title or ""),
+                    self._line(1, f"<updated>{self.updated}</updated>"),
+                    self._line(
+                        1, f'<link href="{escape_attr(data.link)}" rel="alternate"/>'
+                    ),
+                    self._elem(1, "generator", NAME),
+                    self._elem(1, "subtitle", data.description or ""),
+                ]
+            ).encode("utf-8")
+        )
+
+    def item(self, entry: ParsedEntry, escaped: EscapedEntry) -> None:
+        parts = [
+            self._line(1, "<entry>"),
+            self._line(2, f"<id>{escaped.link}</id>"),
+            # Atom requires titles
+            self._line(2, f"<title>{escaped.title or escaped.link}</title>"),
+            self._line(2, f"<updated>{self.updated}</updated>"),
+            self._line(2, f'<link href="{escaped.link_attr}" rel="alternate"/>'),
+        ]
+        if escaped.content:
+            parts.append(
+                self._line(2, f'<content type="text">{escaped.content}</content>')
+            )
+        if escaped.image_attr:
+            parts.append(
+                self._line(2, f'<link href="{escaped.image_attr}" rel="enclosure"/>')
+            )
+        parts.append(self._line(1, "</entry>"))
+
+        self.fh.write("".join(parts).encode("utf-8"))
+
+    def end(self) -> None:
+        self.fh.write(self._line(0, "</feed>").encode("utf-8"))
+
+
+class JSONFeedWriter(Writer):
+    """
+    JSON Feed 1.1 writer
+    """
+
+    def _dumps(self, value: object, depth: int) -> str:
+        if not self.pretty:
+            return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+        return json.dumps(value, ensure_ascii=False, indent=2).replace(
+            "\n", "\n" + "  " * depth
+        )
+
+    def start(self, data: ParsedBuffer, build_date: datetime) -> None:
+        header = {
+            "version": JSON_FEED_VERSION,
+            "title": data.title,
+            "home_page_url": data.link,
+            "description": data.description,
+        }
+        # The header is written as an object and left open for the items
+        self.fh.write((self._dumps(header, 0)[:-1].rstrip() + ",").encode("utf-8"))
+        self.fh.write(
+            ('\n  "items": [' if self.pretty else '"items":[').encode("utf-8")
+        )
+        self.first = True
+
+    def item(self, entry: ParsedEntry, escaped: EscapedEntry) -> None:
+        item = {"id": entry.link, "url": entry.link}
+        if entry.title:
+            item["title"] = entry.title
+        if entry.content:
+            item["content_text"] = entry.content
+        if entry.image:
+            item["image"] = entry.image
+
+        sep = "" if self.first else ","
+        self.first = False
+        if self.pretty:
+            sep += "\n    "
+
+        self.fh.write((sep + self._dumps(item, 2)).encode("utf-8"))
+
+    def end(self) -> None:
+        if self.pretty:
+            self.fh.write(
+                ("\n  ]\n}\n" if not self.first else "]\n}\n").encode("utf-8")
+            )
+        else:
+            self.fh.write(b"]}")
+
+
+WRITERS: dict[str, type[Writer]] = {
+    "rss": RSSWriter,
+    "atom": AtomWriter,
+    "json": JSONFeedWriter,
+}
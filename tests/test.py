@@ -1,15 +1,82 @@
+import argparse
+import contextlib
+import functools
+import gzip
+import hashlib
+import io
+import json
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+import urllib.error
+import urllib.request
+from http.server import (
+    BaseHTTPRequestHandler,
+    SimpleHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
 from pathlib import Path
+from unittest import mock
 
-from rssbuilder import Builder, Parser, Query
+import pydantic
+
+from rssbuilder import Builder, Parser, Query, cli
+from rssbuilder import fetcher as fetcher_mod
+from rssbuilder import pipeline, snapshot
+from rssbuilder.backends import get_backend
+from rssbuilder.breaker import CircuitBreaker
+from rssbuilder.cache import Cache, MissError, SQLiteStore
+from rssbuilder.daemon import Scheduler, retry_delay
+from rssbuilder.explain import explain
+from rssbuilder.fetcher import BodyTooLargeError, Fetcher, FetchPool, Response
 from rssbuilder.fixers import ALL as ALL_FIXERS
 from rssbuilder.fixers import Fixer
-from rssbuilder.models import FeedInfo
-from rssbuilder.parser import ParsedBuffer
+from rssbuilder.history import EntryStore
+from rssbuilder.lease import Leases
+from rssbuilder.manifest import Manifest
+from rssbuilder.metrics import Metrics
+from rssbuilder.models import Config, Feed, FeedInfo
+from rssbuilder.output import OutputWriter
+from rssbuilder.parser import ParsedBuffer, ParsedEntry
+from rssbuilder.query import compile_query
+from rssbuilder.server import FeedCache, FeedServer
+from rssbuilder.strainer import Region, regions_for
+
+SAMPLES_DIR = Path(__file__).parent / "samples"
 
 
 def read_sample(name: str) -> bytes:
-    return (Path(__file__).parent / "samples" / name).read_bytes()
+    return (SAMPLES_DIR / name).read_bytes()
+
+
+class SamplesServer:
+    """
+    Serve tests/samples over HTTP on a random local port
+    """
+
+    class Handler(SimpleHTTPRequestHandler):
+        def log_message(self, *args, **kwargs):
+            pass
+
+    def __enter__(self):
+        handler = functools.partial(self.Handler, directory=str(SAMPLES_DIR))
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}/{name}"
 
 
 class Engine:
@@ -58,6 +125,807 @@ class TestBuilder(unittest.TestCase):
         rss = tvcs.buffer_as_rss(read_sample("tvcs.html"))
         self.assertEqual(len(rss), 4841)
 
+    def test_compact(self):
+        data = ParsedBuffer(
+            link="https://example.com/",
+            title="A & B",
+            description="<desc>",
+            entries=[ParsedEntry(link="https://example.com/1", title="\x01One")],
+        )
+        rss = Builder().build(data, pretty=False)
+
+        self.assertEqual(rss.count("\n"), 1)
+        self.assertIn("<title>A &amp; B</title>", rss)
+        self.assertIn("<description>&lt;desc&gt;</description>", rss)
+        self.assertIn("<item><title>One</title>", rss)
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.feed = Feed(
+            url="https://tvcs.com",
+            name="TVCS",
+            queries={
+                "entries": ".rss_item",
+                "link": {"selector": ".title a", "target": "href"},
+                "title": ".title",
+                "image": {"selector": "amp-img", "target": "src"},
+                "content": ".rss_content p",
+                "date": ".rss_content small",
+            },
+        )
+
+    def test_work_unit_is_picklable(self):
+        self.assertEqual(pickle.loads(pickle.dumps(self.feed)), self.feed)
+
+        data = Parser.from_queries(self.feed.queries).parse(read_sample("tvcs.html"))
+        self.assertEqual(pickle.loads(pickle.dumps(data)), data)
+
+    def test_build_all_with_workers(self):
+        jobs = [(self.feed, read_sample("tvcs.html"))] * 2
+        serial = [len(out["rss"]) for _, out in pipeline.build_all(jobs)]
+        parallel = [len(out["rss"]) for _, out in pipeline.build_all(jobs, workers=2)]
+
+        self.assertEqual(len(serial), 2)
+        self.assertEqual(parallel, serial)
+
+    def test_streaming_matches_batch(self):
+        def strip_date(rss: bytes) -> bytes:
+            return re.sub(rb"<lastBuildDate>.*</lastBuildDate>", b"", rss)
+
+        buff = read_sample("tvcs.html")
+        data = Parser.from_queries(self.feed.queries).parse(buff)
+        for FixerCls in ALL_FIXERS:
+            FixerCls(self.feed).fix(data)  # type: ignore[abstract]
+        batch = Builder().build(data).encode("utf-8")
+
+        self.assertEqual(strip_date(pipeline.build(self.feed, buff)), strip_date(batch))
+
+        limited = self.feed.model_copy(update={"max_items": 2})
+        rss = pipeline.build(limited, buff).decode("utf-8")
+        self.assertEqual(rss.count("<item>"), 2)
+        self.assertIn(data.entries[1].link, rss)
+        self.assertNotIn(data.entries[2].link, rss)
+
+    def test_low_memory(self):
+        buff = read_sample("tvcs.html")
+        low_memory = self.feed.model_copy(
+            update={"low_memory": True, "max_input_bytes": len(buff)}
+        )
+        metrics = Metrics(trace_memory=True)
+
+        self.assertEqual(
+            pipeline.build(low_memory, buff, metrics=metrics).count(b"<item>"),
+            pipeline.build(self.feed, buff).count(b"<item>"),
+        )
+        self.assertGreater(metrics.as_dict()["feeds"]["TVCS"]["peak_memory_bytes"], 0)
+
+        truncated = low_memory.model_copy(update={"max_input_bytes": len(buff) // 2})
+        self.assertLess(
+            pipeline.build(truncated, buff).count(b"<item>"),
+            pipeline.build(self.feed, buff).count(b"<item>"),
+        )
+
+    def test_formats(self):
+        feed = self.feed.model_copy(update={"formats": ["rss", "atom", "json"]})
+        calls = []
+        original = Parser.stream
+
+        def stream(parser, buff):
+            calls.append(buff)
+            return original(parser, buff)
+
+        with mock.patch.object(Parser, "stream", stream):
+            outputs = pipeline.build_formats(feed, read_sample("tvcs.html"))
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(list(outputs), ["rss", "atom", "json"])
+        self.assertEqual(outputs["rss"].count(b"<item>"), 6)
+        self.assertEqual(outputs["atom"].count(b"<entry>"), 6)
+        self.assertEqual(len(json.loads(outputs["json"])["items"]), 6)
+
+    def test_metrics(self):
+        jobs = [(self.feed, read_sample("tvcs.html"))] * 2
+        serial, parallel = Metrics(), Metrics()
+        start = time.perf_counter()
+        list(pipeline.build_all(jobs, metrics=serial))
+        elapsed = time.perf_counter() - start
+        list(pipeline.build_all(jobs, workers=2, metrics=parallel))
+
+        for metrics in (serial, parallel):
+            feed = metrics.as_dict()["feeds"]["TVCS"]
+            self.assertEqual(feed["entries"], 2 * 6)
+            self.assertEqual(set(feed["stage_seconds"]), {"parse", "fix", "build"})
+
+        # Stages run interleaved but time isn't counted twice
+        self.assertLessEqual(
+            sum(serial.as_dict()["feeds"]["TVCS"]["stage_seconds"].values()), elapsed
+        )
+
+        prom = serial.as_prometheus()
+        self.assertIn("# TYPE rssbuilder_stage_seconds gauge", prom)
+        self.assertIn('rssbuilder_entries{feed="TVCS"} 12', prom)
+
+    def test_explain(self):
+        explanation = explain(self.feed, read_sample("tvcs.html"))
+        stats = {x.name: x for x in explanation.queries}
+
+        self.assertEqual(explanation.entries, 6)
+        self.assertEqual(
+            list(stats),
+            ["feed_link", "feed_title", "entries"]
+            + ["link", "title", "content", "date", "image"],
+        )
+        self.assertEqual((stats["entries"].calls, stats["entries"].matches), (1, 6))
+        self.assertEqual((stats["link"].calls, stats["link"].matches), (6, 6))
+        self.assertEqual(stats["content"].selector, ".rss_content p")
+        self.assertGreater(explanation.total_time, explanation.parse_time)
+
+    def test_explain_command_isolates_failures(self):
+        # Nothing listens on port 1, fetching it fails right away
+        dead = self.feed.model_copy(
+            update={"name": "Dead", "url": "http://127.0.0.1:1/"}
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = Config(
+                output_dir=Path(tmpdir) / "output",
+                cache_dir=Path(tmpdir) / "cache",
+                breaker_threshold=1,
+                feeds=[dead, self.feed],
+            )
+            Cache.from_config(config).set(self.feed.url, read_sample("tvcs.html"))
+
+            for _ in range(2):
+                stdout, stderr = io.StringIO(), io.StringIO()
+                args = argparse.Namespace(feeds=None, cached_only=False)
+                with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(
+                    stderr
+                ):
+                    self.assertEqual(cli.explain_command(config, args), 1)
+
+                self.assertIn("TVCS", stdout.getvalue())
+                self.assertIn("Dead", stderr.getvalue())
+
+            # The second run skipped the failing host
+            self.assertIn("is failing", stderr.getvalue())
+
+    def test_build_all_isolates_failures(self):
+        broken = self.feed.model_copy(update={"name": "Broken"})
+        build_formats = pipeline.build_formats
+
+        def build_or_fail(feed, *args, **kwargs):
+            if feed is broken:
+                raise ValueError("broken page")
+            return build_formats(feed, *args, **kwargs)
+
+        failures = {}
+        buff = read_sample("tvcs.html")
+        with mock.patch.object(pipeline, "build_formats", build_or_fail):
+            built = list(
+                pipeline.build_all(
+                    [(broken, buff), (self.feed, buff)],
+                    on_error=lambda feed, e: failures.setdefault(feed.name, e),
+                )
+            )
+
+        self.assertEqual([feed.name for feed, _ in built], ["TVCS"])
+        self.assertIsInstance(failures["Broken"], ValueError)
+
+
+class TestBackends(unittest.TestCase):
+    PARSERS = {
+        "tvcs.html": dict(
+            entries=".rss_item",
+            link=Query(selector=".title a", target="href"),
+            title=".title",
+            image=Query(selector="amp-img", target="src"),
+            content=".rss_content p",
+            date=".rss_content small",
+        ),
+        "vivecastellon.html": dict(
+            entries=".top-noticias-noticia",
+            link=Query(selector="a.top-noticias-noticia-mas-info", target="href"),
+            title=".top-noticias-noticia-title",
+            image=Query(selector=".top-noticias-noticia img", target="src"),
+            content=None,
+            date=None,
+        ),
+    }
+
+    def test_identical_output(self):
+        for sample, params in self.PARSERS.items():
+            expected = Parser(**params).parse(read_sample(sample))
+            self.assertTrue(expected.entries)
+
+            for backend in ["lxml", "selectolax"]:
+                with self.subTest(sample=sample, backend=backend):
+                    parser = Parser(**params, backend=backend)
+                    self.assertEqual(parser.parse(read_sample(sample)), expected)
+
+    def test_partial_parse(self):
+        for sample, params in self.PARSERS.items():
+            expected = Parser(**params).parse(read_sample(sample))
+
+            for backend in ["html.parser", "lxml"]:
+                with self.subTest(sample=sample, backend=backend):
+                    parser = Parser(**params, backend=backend, partial=True)
+                    self.assertIsNotNone(parser.plan.regions)
+                    self.assertEqual(parser.parse(read_sample(sample)), expected)
+
+                    # The restricted tree must really skip elements
+                    soup = get_backend(backend).parse(read_sample(sample))
+                    partial = get_backend(backend).parse(
+                        read_sample(sample), regions=parser.plan.regions
+                    )
+                    self.assertLess(
+                        len(partial.find_all(True)), len(soup.find_all(True))
+                    )
+
+    def test_partial_parse_regions(self):
+        self.assertEqual(
+            regions_for("div.item[data-x='1'], #main > .entry"),
+            [
+                Region(
+                    name="div", classes=frozenset(["item"]), attrs=(("data-x", "1"),)
+                ),
+                Region(id="main"),
+            ],
+        )
+        self.assertIsNone(regions_for(".a + .b"))
+        self.assertIsNone(regions_for("li:nth-child(2)"))
+
+
+class TestQueryPlan(unittest.TestCase):
+    def test_compiled_queries_are_shared(self):
+        backend = get_backend("html.parser")
+
+        self.assertIs(
+            compile_query(".title", backend),
+            compile_query(Query(selector=".title"), backend),
+        )
+
+        a = Parser(
+            entries=".rss_item",
+            link=".title a",
+            title=None,
+            content=None,
+            date=None,
+            image=None,
+        )
+        b = Parser(
+            entries=".rss_item",
+            link=".title a",
+            title=".title",
+            content=None,
+            date=None,
+            image=None,
+        )
+        self.assertIs(a.plan.entries, b.plan.entries)
+        self.assertIs(a.plan.feed_link, b.plan.feed_link)
+
+
+class TestFetchPool(unittest.TestCase):
+    def test_per_host_limit(self):
+        lock = threading.Lock()
+        running: dict[str, int] = {}
+        peak: dict[str, int] = {}
+
+        class FakeFetcher:
+            def fetch_response(self, url: str, validators=None) -> Response:
+                host = url.split("/")[2]
+                with lock:
+                    running[host] = running.get(host, 0) + 1
+                    peak[host] = max(peak.get(host, 0), running[host])
+                time.sleep(0.01)
+                with lock:
+                    running[host] -= 1
+
+                return Response(body=url.encode("utf-8"))
+
+        urls = [f"https://{host}/{idx}" for host in "ab" for idx in range(6)]
+        with FetchPool(max_workers=8, max_per_host=2, fetcher=FakeFetcher()) as pool:
+            results = pool.fetch_all(urls + urls[:2])
+
+        self.assertEqual(list(results), urls)
+        self.assertEqual(results[urls[0]].body, urls[0].encode("utf-8"))
+        self.assertEqual(peak, {"a": 2, "b": 2})
+
+    def test_busy_host_doesnt_block_others(self):
+        class FakeFetcher:
+            def fetch_response(self, url: str, validators=None) -> Response:
+                if "slow" in url:
+                    time.sleep(0.2)
+
+                return Response(body=b"")
+
+        with FetchPool(max_workers=2, max_per_host=1, fetcher=FakeFetcher()) as pool:
+            start = time.monotonic()
+            slow = [pool.submit(f"https://slow/{idx}") for idx in range(4)]
+            pool.submit("https://fast/").result()
+            self.assertLess(time.monotonic() - start, 0.15)
+
+            for fut in slow:
+                fut.result()
+
+
+class TestConditionalFetch(unittest.TestCase):
+    def test_not_modified(self):
+        with tempfile.TemporaryDirectory() as tmpdir, SamplesServer() as server:
+            url = server.url("tvcs.html")
+            cache = Cache(Path(tmpdir))
+
+            resp = Fetcher().fetch_response(url)
+            self.assertFalse(resp.not_modified)
+            self.assertIn("last_modified", resp.validators)
+            cache.set(url, resp.body, resp.validators)
+
+            body, validators = cache.get_stale(url)
+            self.assertEqual(body, read_sample("tvcs.html"))
+
+            resp = Fetcher().fetch_response(url, validators)
+            self.assertTrue(resp.not_modified)
+            self.assertEqual(resp.body, b"")
+
+    def test_keep_alive_and_compression(self):
+        clients = set()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                clients.add(self.client_address)
+                body = gzip.compress(read_sample("tvcs.html"))
+                self.send_response(200)
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args, **kwargs):
+                pass
+
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{httpd.server_port}/"
+
+        try:
+            with Fetcher() as fetcher:
+                for _ in range(3):
+                    self.assertEqual(fetcher.fetch(url), read_sample("tvcs.html"))
+
+            self.assertEqual(len(clients), 1)
+
+            with Fetcher(max_body_size=1024) as fetcher:
+                with self.assertRaises(BodyTooLargeError):
+                    fetcher.fetch(url)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    @unittest.skipUnless(fetcher_mod.brotli, "brotli not available")
+    def test_brotli_output_is_bounded(self):
+        bomb = fetcher_mod.brotli.compress(b"\0" * (64 * 1024 * 1024))
+        decoder = fetcher_mod._BrotliDecoder()
+        self.assertLessEqual(len(decoder(bomb, 1025)), 64 * 1024)
+
+
+class TestStaleCache(unittest.TestCase):
+    # Nothing listens there, fetches fail right away
+    URL = "http://127.0.0.1:1/tvcs.html"
+
+    def build(self, **windows) -> tuple[dict[str, Exception], bool]:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = Config(
+                output_dir=Path(tmpdir) / "output",
+                cache_dir=Path(tmpdir) / "cache",
+                ttl=60,
+                feeds=[
+                    {
+                        "url": self.URL,
+                        "name": "TVCS",
+                        "queries": {
+                            "entries": ".rss_item",
+                            "link": {"selector": ".title a", "target": "href"},
+                            "title": ".title",
+                        },
+                    }
+                ],
+                **windows,
+            )
+
+            # Cached two minutes ago, expired for a 60s TTL
+            cache = Cache.from_config(config)
+            cache.set(self.URL, read_sample("tvcs.html"))
+            mtime = time.time() - 120
+            os.utime(cache.store._calc_filepath(self.URL), (mtime, mtime))
+
+            failures = cli.build(config, argparse.Namespace(jobs=1, force=False))
+            return failures, (config.output_dir / "tvcs.rss").exists()
+
+    def test_expired(self):
+        failures, built = self.build(stale_while_revalidate=30, stale_if_error=30)
+        self.assertEqual(list(failures), ["TVCS"])
+        self.assertFalse(built)
+
+    def test_stale_while_revalidate(self):
+        self.assertEqual(self.build(stale_while_revalidate=300), ({}, True))
+
+    def test_stale_if_error(self):
+        self.assertEqual(self.build(stale_if_error=300), ({}, True))
+
+
+class TestSQLiteStore(unittest.TestCase):
+    def test_lru_eviction(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = SQLiteStore(Path(tmpdir) / "cache.sqlite")
+            cache = Cache(Path(tmpdir), store=store)
+
+            body = read_sample("tvcs.html")
+            cache.set("a", body, {"etag": "x"})
+            self.assertEqual(cache.get("a"), body)
+            self.assertEqual(cache.get_stale("a"), (body, {"etag": "x"}))
+            stored_size = store.stats()["stored_size"]
+            self.assertLess(stored_size, len(body))
+
+            # Room for two entries
+            store.max_size = stored_size * 2 + 1
+
+            for key in ["b", "c", "d"]:
+                cache.set(key, body)
+                time.sleep(0.01)
+            cache.get("a")
+
+            self.assertEqual(store.gc(), 2)
+            cache.get("a")
+            cache.get("d")
+            with self.assertRaises(MissError):
+                cache.get("b")
+
+            self.assertEqual(store.purge(), 2)
+            self.assertEqual(store.stats()["entries"], 0)
+
+
+class TestEntryStore(unittest.TestCase):
+    def test_merge_and_window(self):
+        def entries(*links):
+            return [ParsedEntry(link=x, title=x.upper()) for x in links]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with EntryStore(Path(tmpdir) / "entries.sqlite") as store:
+                store.merge("feed", entries("b", "a"), now=100)
+                store.merge("other", entries("x"), now=150)
+                store.merge("feed", entries("d", "c", "b"), now=200)
+
+                links = [x.link for x in store.window("feed")]
+                self.assertEqual(links, ["d", "c", "b", "a"])
+
+                links = [x.link for x in store.window("feed", max_items=3)]
+                self.assertEqual(links, ["d", "c", "b"])
+
+                window = store.window("feed", max_age=50, now=220)
+                self.assertEqual([x.link for x in window], ["d", "c"])
+                self.assertEqual(window[0].title, "D")
+
+
+class TestConfigSnapshot(unittest.TestCase):
+    FEED = """
+url: https://example.com/{idx}
+name: Feed {idx}
+queries:
+  entries: .item
+  link: {{selector: a, target: href}}
+"""
+
+    def test_snapshot_and_includes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = Path(tmpdir)
+            (tmpdir / "feeds.d").mkdir()
+            config_path = tmpdir / "config.yaml"
+            config_path.write_text(
+                "output_dir: out\ninclude: feeds.d\nttl: 60\nfeeds:\n"
+                + "  - "
+                + self.FEED.format(idx=0).strip().replace("\n", "\n    ")
+            )
+            for idx in (1, 2):
+                (tmpdir / "feeds.d" / f"{idx}.yaml").write_text(
+                    self.FEED.format(idx=idx)
+                )
+
+            config = Config.from_filepath(config_path, tmpdir / "snapshots")
+            self.assertEqual(
+                [x.name for x in config.feeds], ["Feed 0", "Feed 1", "Feed 2"]
+            )
+            self.assertEqual({x.ttl for x in config.feeds}, {60})
+            self.assertEqual(config.output_dir, tmpdir / "out")
+
+            (tmpdir / "feeds.d" / "2.yaml").write_text(self.FEED.format(idx=3))
+            with mock.patch.object(
+                snapshot, "_validate_config", side_effect=AssertionError
+            ), mock.patch.object(
+                snapshot, "_validate_feeds", wraps=snapshot._validate_feeds
+            ) as validate_feeds:
+                config = Config.from_filepath(config_path, tmpdir / "snapshots")
+
+            self.assertEqual(validate_feeds.call_count, 1)
+            self.assertEqual(config.feeds[-1].name, "Feed 3")
+            self.assertEqual(config.feeds[-1].ttl, 60)
+
+            config_path.write_text(config_path.read_text().replace("60", "120"))
+            config = Config.from_filepath(config_path, tmpdir / "snapshots")
+            self.assertEqual({x.ttl for x in config.feeds}, {120})
+
+            # A missing include directory holds no feeds
+            shutil.rmtree(tmpdir / "feeds.d")
+            config = Config.from_filepath(config_path, tmpdir / "snapshots")
+            self.assertEqual([x.name for x in config.feeds], ["Feed 0"])
+
+            # Shared mode checks cover included feeds
+            (tmpdir / "feeds.d").mkdir()
+            (tmpdir / "feeds.d" / "1.yaml").write_text(
+                self.FEED.format(idx=1) + "history_items: 10\n"
+            )
+            config_path.write_text("lease_duration: 60\n" + config_path.read_text())
+            with self.assertRaises(pydantic.ValidationError):
+                Config.from_filepath(config_path, tmpdir / "snapshots")
+
+
+class TestManifest(unittest.TestCase):
+    def test_is_current(self):
+        feed = Feed(
+            url="https://tvcs.com", name="TVCS", queries={"entries": "a", "link": "a"}
+        )
+        buff = read_sample("tvcs.html")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = Path(tmpdir) / "tvcs.rss"
+            manifest = Manifest(Path(tmpdir) / "manifest.json")
+            manifest.load()
+            self.assertFalse(manifest.is_current(feed, buff, output))
+
+            output.write_text("")
+            manifest.update(feed, buff, output)
+            manifest.save()
+
+            manifest = Manifest(Path(tmpdir) / "manifest.json")
+            manifest.load()
+            self.assertTrue(manifest.is_current(feed, buff, output))
+            self.assertFalse(manifest.is_current(feed, buff + b" ", output))
+
+            # Config-level output settings count too
+            manifest = Manifest(
+                Path(tmpdir) / "manifest.json", settings={"compact_output": True}
+            )
+            manifest.load()
+            self.assertFalse(manifest.is_current(feed, buff, output))
+
+            feed.queries.entries = "b"
+            self.assertFalse(manifest.is_current(feed, buff, output))
+
+    def test_concurrent_saves(self):
+        feed = Feed(
+            url="https://tvcs.com", name="TVCS", queries={"entries": "a", "link": "a"}
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            outputs = [Path(tmpdir) / "a.rss", Path(tmpdir) / "b.rss"]
+            manifests = [Manifest(Path(tmpdir) / "manifest.json") for _ in outputs]
+            for manifest in manifests:
+                manifest.load()
+
+            # Each worker keeps the records saved by the other one
+            for manifest, output in zip(manifests, outputs):
+                output.write_text("")
+                manifest.update(feed, b"", output)
+                manifest.save()
+
+            manifest = Manifest(Path(tmpdir) / "manifest.json")
+            manifest.load()
+            self.assertTrue(manifest.is_current(feed, b"", *outputs))
+
+
+class TestLeases(unittest.TestCase):
+    def test_shared_cache_config(self):
+        with self.assertRaises(pydantic.ValidationError):
+            Config(output_dir="out", lease_duration=60, cache_backend="sqlite")
+
+        with self.assertRaises(pydantic.ValidationError):
+            Config(output_dir="out", lease_duration=60, history_items=10)
+
+    def test_claim_and_expiry(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            a = Leases(Path(tmpdir), duration=60, owner="a")
+            b = Leases(Path(tmpdir), duration=60, owner="b")
+
+            self.assertTrue(a.claim("http://example.com/", now=0))
+            self.assertTrue(a.claim("http://example.com/", now=0))
+            self.assertFalse(b.claim("http://example.com/", now=30))
+            self.assertTrue(b.claim("http://example.org/", now=30))
+
+            # Renewed claims last longer, expired ones are taken over
+            a.renew(now=30)
+            self.assertFalse(b.claim("http://example.com/", now=60))
+            self.assertTrue(b.claim("http://example.com/", now=90))
+
+            # The former owner loses its claim instead of renewing the new one
+            a.renew(now=95)
+            self.assertNotIn("http://example.com/", a.claimed)
+            lease = Path(tmpdir) / (
+                hashlib.sha256(b"http://example.com/").hexdigest() + ".lease"
+            )
+            self.assertEqual(lease.stat().st_mtime, 90)
+            self.assertFalse(a.claim("http://example.com/", now=95))
+
+            # A stale owner doesn't remove the new claim
+            a.release("http://example.com/")
+            self.assertFalse(a.claim("http://example.com/", now=90))
+
+            b.release_all()
+            self.assertTrue(a.claim("http://example.com/", now=90))
+            self.assertEqual(
+                sorted(x.name for x in Path(tmpdir).iterdir()),
+                [hashlib.sha256(b"http://example.com/").hexdigest() + ".lease"],
+            )
+
+    def test_batches_are_shared(self):
+        urls = [f"http://example.com/{i}" for i in range(5)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            a = Leases(Path(tmpdir), owner="a").claim_batches(urls, 2)
+            b = Leases(Path(tmpdir), owner="b").claim_batches(urls, 2)
+
+            # Batches are claimed as workers get to them
+            self.assertEqual(next(a), urls[0:2])
+            self.assertEqual(next(b), urls[2:4])
+            self.assertEqual(next(a), urls[4:])
+            self.assertEqual(list(b), [])
+
+
+class TestOutputWriter(unittest.TestCase):
+    def test_change_aware_write(self):
+        def doc(date: str, title: str = "A") -> bytes:
+            return (
+                f"<rss><channel><title>{title}</title>"
+                f"<lastBuildDate>{date}</lastBuildDate></channel></rss>"
+            ).encode("utf-8")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = Path(tmpdir) / "feed.rss"
+            writer = OutputWriter(["gzip"])
+
+            self.assertTrue(writer.write(output, doc("Mon")))
+            self.assertEqual(
+                gzip.decompress(output.with_suffix(".rss.gz").read_bytes()), doc("Mon")
+            )
+
+            self.assertFalse(writer.write(output, doc("Tue")))
+            self.assertEqual(output.read_bytes(), doc("Mon"))
+
+            self.assertTrue(writer.write(output, doc("Wed", title="B")))
+            self.assertEqual(output.read_bytes(), doc("Wed", title="B"))
+            self.assertEqual(
+                gzip.decompress(output.with_suffix(".rss.gz").read_bytes()),
+                doc("Wed", title="B"),
+            )
+            self.assertEqual(
+                sorted(x.name for x in Path(tmpdir).iterdir()),
+                ["feed.rss", "feed.rss.gz"],
+            )
+
+            # Siblings of disabled compressions are removed, not left outdated
+            self.assertTrue(OutputWriter().write(output, doc("Thu", title="C")))
+            self.assertEqual(
+                sorted(x.name for x in Path(tmpdir).iterdir()), ["feed.rss"]
+            )
+
+
+class TestServer(unittest.TestCase):
+    def test_conditional_requests(self):
+        with tempfile.TemporaryDirectory() as tmpdir, SamplesServer() as samples:
+            config = Config(
+                output_dir=Path(tmpdir),
+                cache_dir=Path(tmpdir),
+                feeds=[
+                    {
+                        "url": samples.url("tvcs.html"),
+                        "name": "TVCS",
+                        "queries": {
+                            "entries": ".rss_item",
+                            "link": {"selector": ".title a", "target": "href"},
+                            "title": ".title",
+                        },
+                    }
+                ],
+            )
+            # Feeds without a usable slug are skipped
+            config.feeds.append(config.feeds[0].model_copy(update={"name": "∅"}))
+            httpd = FeedServer(("127.0.0.1", 0), FeedCache(config))
+            self.assertEqual(list(httpd.feeds.feeds), ["tvcs"])
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{httpd.server_port}/tvcs.rss"
+
+            try:
+                with urllib.request.urlopen(url) as resp:
+                    etag = resp.headers["ETag"]
+                    self.assertIn(b"<rss", resp.read())
+
+                req = urllib.request.Request(url, headers={"If-None-Match": etag})
+                with self.assertRaises(urllib.error.HTTPError) as ctx:
+                    urllib.request.urlopen(req)
+                self.assertEqual(ctx.exception.code, 304)
+
+                req = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+                with urllib.request.urlopen(req) as resp:
+                    self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+                    self.assertNotEqual(resp.headers["ETag"], etag)
+
+            finally:
+                httpd.shutdown()
+                httpd.server_close()
+
+
+class TestScheduler(unittest.TestCase):
+    def test_order_and_reschedule(self):
+        scheduler = Scheduler(jitter=0)
+        scheduler.schedule("a", 10, now=0)
+        scheduler.schedule("b", 5, now=0)
+        scheduler.schedule("c", 20, now=0)
+        scheduler.schedule("a", 30, now=0)
+        scheduler.discard("c")
+
+        self.assertEqual(scheduler.next_due(), 5)
+        self.assertEqual(scheduler.pop_due(now=25), ["b"])
+        self.assertEqual(scheduler.pop_due(now=30), ["a"])
+        self.assertEqual(len(scheduler), 0)
+
+    def test_jitter_and_backoff(self):
+        scheduler = Scheduler(jitter=0.1)
+        due = scheduler.schedule("a", 100, now=0)
+        self.assertTrue(90 <= due <= 110)
+
+        self.assertEqual([retry_delay(x) for x in [1, 2, 3]], [60, 120, 240])
+        self.assertEqual(retry_delay(1000), 60 * 60 * 6)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_and_half_open(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            breaker = CircuitBreaker(Path(tmpdir) / "circuits.json", threshold=2)
+            url = "http://example.com/news"
+
+            breaker.failure(url, now=0)
+            self.assertTrue(breaker.allow(url, now=0))
+            breaker.failure(url, now=0)
+            self.assertFalse(breaker.allow("http://EXAMPLE.com/other", now=30))
+            self.assertTrue(breaker.allow("http://example.org/", now=30))
+
+            breaker.save()
+            breaker = CircuitBreaker(Path(tmpdir) / "circuits.json", threshold=2)
+            breaker.load()
+
+            # A single probe after the deadline, failing opens it for longer
+            self.assertTrue(breaker.allow(url, now=60))
+            self.assertFalse(breaker.allow(url, now=60))
+            breaker.failure(url, now=60)
+            self.assertEqual(breaker.retry_at(url), 60 + 120)
+
+            self.assertTrue(breaker.allow(url, now=180))
+            breaker.success(url)
+            self.assertTrue(breaker.allow(url, now=180))
+            self.assertEqual(breaker.hosts, {})
+
+    def test_concurrent_saves(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            a = CircuitBreaker(Path(tmpdir) / "circuits.json", threshold=1)
+            b = CircuitBreaker(Path(tmpdir) / "circuits.json", threshold=1)
+            a.failure("http://example.com/", now=0)
+            a.save()
+            b.failure("http://example.org/", now=0)
+            b.save()
+
+            breaker = CircuitBreaker(Path(tmpdir) / "circuits.json", threshold=1)
+            breaker.load()
+            self.assertEqual(set(breaker.hosts), {"example.com", "example.org"})
+
 
 if __name__ == "__main__":
     unittest.main()